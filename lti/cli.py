@@ -1,6 +1,20 @@
+import config
+import redis
 from Crypto.PublicKey import RSA
 from flask import Flask
+from redis.exceptions import ConnectionError
 from sqlalchemy.exc import IntegrityError
+from utils import invalidate_lti_config
+
+
+def invalidate_cached_lti_config():
+    try:
+        invalidate_lti_config(redis.from_url(config.REDIS_URL))
+    except ConnectionError:
+        print(
+            "Unable to reach Redis. Running workers will pick up this change "
+            f"within {config.LTI_CONFIG_CACHE_TTL} seconds."
+        )
 
 
 def register_cli(app: Flask):
@@ -66,6 +80,7 @@ def register_cli(app: Flask):
             )
             db.session.add(newkey)
             db.session.commit()
+            invalidate_cached_lti_config()
             print(
                 f"Created new Public and Private key #{newkey.id} ({newkey.alg}) "
                 f"in key set #{newkey.key_set_id}"
@@ -169,6 +184,7 @@ def register_cli(app: Flask):
             )
             db.session.add(new_reg)
             db.session.commit()
+            invalidate_cached_lti_config()
 
             print(
                 f"Created new registration: {new_reg.id}\n"
@@ -208,4 +224,5 @@ def register_cli(app: Flask):
         )
         db.session.add(new_deploy)
         db.session.commit()
+        invalidate_cached_lti_config()
         print(f"Added deployment {new_deploy.id} ({new_deploy.deployment_id}).")
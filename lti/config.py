@@ -18,6 +18,56 @@ PREFERRED_URL_SCHEME = os.environ.get("PREFERRED_URL_SCHEME", "https")
 # The maximum amount of objects the Canvas API will return per page (usually 100)
 MAX_PER_PAGE = int(os.environ.get("MAX_PER_PAGE", 100))
 
+# The maximum number of quizzes a single job will send extensions for at once.
+# Set to 1 to extend quizzes one at a time.
+EXTENSION_CONCURRENCY = int(os.environ.get("EXTENSION_CONCURRENCY", 4))
+
+# Set to 1 to have update jobs read each Classic Quiz's current extensions
+# first and only send the ones that changed. This costs an extra request per
+# quiz, so it only pays off when most students already have their time.
+# Refresh jobs always do this, since they read each quiz once for all
+# students.
+EXTENSION_SKIP_UNCHANGED = int(os.environ.get("EXTENSION_SKIP_UNCHANGED", 0)) == 1
+
+# The number of keep-alive connections each process holds open to Canvas.
+# This should be at least the larger of gunicorn's `threads` (see
+# devops/gunicorn_conf.py) and EXTENSION_CONCURRENCY, so no thread or job
+# has to wait for a connection or open a throwaway one.
+CANVAS_POOL_SIZE = int(
+    os.environ.get("CANVAS_POOL_SIZE", max(EXTENSION_CONCURRENCY, 3))
+)
+
+# Canvas rate limits API calls with a "bucket" of request cost shared by
+# everything using the API key. Once the remaining cost reported by Canvas
+# drops below CANVAS_RATE_LIMIT_THRESHOLD, every worker waits before each
+# call, up to CANVAS_THROTTLE_MAX_DELAY seconds as the bucket runs dry.
+CANVAS_RATE_LIMIT_THRESHOLD = float(os.environ.get("CANVAS_RATE_LIMIT_THRESHOLD", 300))
+CANVAS_THROTTLE_MAX_DELAY = float(os.environ.get("CANVAS_THROTTLE_MAX_DELAY", 2))
+
+# Extensions that fail with a transient Canvas error (rate limiting, 5xx,
+# timeouts or dropped connections) are tried up to CANVAS_RETRY_ATTEMPTS
+# times. The wait between attempts doubles from CANVAS_RETRY_BASE_DELAY
+# seconds, up to CANVAS_RETRY_MAX_DELAY.
+CANVAS_RETRY_ATTEMPTS = int(os.environ.get("CANVAS_RETRY_ATTEMPTS", 4))
+CANVAS_RETRY_BASE_DELAY = float(os.environ.get("CANVAS_RETRY_BASE_DELAY", 1))
+CANVAS_RETRY_MAX_DELAY = float(os.environ.get("CANVAS_RETRY_MAX_DELAY", 30))
+
+# Course quiz listings from Canvas are cached in Redis for up to
+# CANVAS_HTTP_CACHE_TTL seconds and revalidated with conditional requests, so
+# a course whose quizzes haven't changed costs a single 304 response.
+CANVAS_HTTP_CACHE_TTL = int(os.environ.get("CANVAS_HTTP_CACHE_TTL", 86400))
+
+# Classic and New Quizzes are listed at the same time. The New Quizzes API can
+# be slow, so its listing is abandoned (and treated as empty) after
+# NEW_QUIZZES_TIMEOUT seconds.
+NEW_QUIZZES_TIMEOUT = float(os.environ.get("NEW_QUIZZES_TIMEOUT", 30))
+
+# The missing/stale quizzes banner check is cached per course. After
+# MISSING_CHECK_TTL seconds the cached answer is still used, but rechecked in
+# the background; after MISSING_CHECK_MAX_AGE seconds it is discarded.
+MISSING_CHECK_TTL = int(os.environ.get("MISSING_CHECK_TTL", 60))
+MISSING_CHECK_MAX_AGE = int(os.environ.get("MISSING_CHECK_MAX_AGE", 3600))
+
 # A secret key used by Flask for signing. KEEP THIS SECRET!
 # (e.g. 'Ro0ibrkb4Z4bZmz1f5g1+/16K19GH/pa')
 SECRET_KEY = os.environ.get("SECRET_KEY")
@@ -36,6 +86,38 @@ GOOGLE_ANALYTICS = os.environ.get(
 # REDIS_URL = "redis://quiz_redis:6379"
 REDIS_URL = os.environ.get("REDIS_URL")
 
+# How long (in seconds) a worker may reuse its cached LTI configuration before
+# reloading it from the database. The `register`, `deploy` and `generate_keys`
+# commands invalidate the cache immediately.
+LTI_CONFIG_CACHE_TTL = int(os.environ.get("LTI_CONFIG_CACHE_TTL", 300))
+
+# How long (in seconds) the platform may cache the tool's public JWKS.
+JWKS_MAX_AGE = int(os.environ.get("JWKS_MAX_AGE", 600))
+
+# Job progress streams (/jobs/<job_key>/stream/) hold a web thread open for as
+# long as they run, which the default gthread worker with 3 threads (see
+# devops/gunicorn_conf.py) can't afford. Only set JOB_STREAM_ENABLED when
+# gunicorn uses an async worker class (gevent or eventlet); otherwise the
+# browser polls /jobs/ and streams send a single update and close.
+JOB_STREAM_ENABLED = int(os.environ.get("JOB_STREAM_ENABLED", 0)) == 1
+
+# Each stream is closed after JOB_STREAM_TIMEOUT seconds and the browser
+# reconnects. If nothing is published for JOB_STREAM_HEARTBEAT seconds the
+# job is checked directly.
+JOB_STREAM_TIMEOUT = int(os.environ.get("JOB_STREAM_TIMEOUT", 60))
+JOB_STREAM_HEARTBEAT = int(os.environ.get("JOB_STREAM_HEARTBEAT", 5))
+
+# Progress updates from a running job are written to Redis at most every
+# JOB_PROGRESS_INTERVAL seconds, unless progress has moved by at least
+# JOB_PROGRESS_STEP percent. Status changes are always written immediately.
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", 1))
+JOB_PROGRESS_STEP = int(os.environ.get("JOB_PROGRESS_STEP", 5))
+
+# Course rosters used by the student search (/filter/<course_id>/) are
+# cached in Redis for ROSTER_CACHE_TTL seconds before being fetched from
+# Canvas again.
+ROSTER_CACHE_TTL = int(os.environ.get("ROSTER_CACHE_TTL", 300))
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
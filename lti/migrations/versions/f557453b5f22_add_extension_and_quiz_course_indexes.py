@@ -0,0 +1,40 @@
+"""Add Extension and Quiz course indexes
+
+Revision ID: f557453b5f22
+Revises: ff2a37151e96
+Create Date: 2026-10-18 10:12:31.204518
+
+Duplicate extensions for the same course/user pair are deleted before the
+unique constraint is added, keeping the lowest id. That is the row the app
+has been reading and updating, since `.first()` on MySQL/InnoDB returns
+rows in primary key order. `downgrade()` only drops the constraint and
+index; it cannot bring back the deleted duplicates.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f557453b5f22'
+down_revision = 'ff2a37151e96'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Keep only the oldest extension for each course/user pair, which is
+    # the one the app treats as current, so the unique index can be created.
+    op.execute(
+        "DELETE FROM extension WHERE id NOT IN ("
+        "SELECT id FROM ("
+        "SELECT MIN(id) AS id FROM extension GROUP BY course_id, user_id"
+        ") AS current_extension)"
+    )
+    op.create_unique_constraint(
+        'uq_extension_course_user', 'extension', ['course_id', 'user_id']
+    )
+    op.create_index('ix_quiz_course_canvas', 'quiz', ['course_id', 'canvas_id'])
+
+
+def downgrade():
+    op.drop_index('ix_quiz_course_canvas', table_name='quiz')
+    op.drop_constraint('uq_extension_course_user', 'extension', type_='unique')
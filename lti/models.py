@@ -36,6 +36,8 @@ class Course(db.Model):
         db.DateTime, server_default=db.func.now(), onupdate=db.func.now()
     )
     quizzes = db.relationship("Quiz", backref="course", lazy="dynamic")
+    # When the course's quizzes were last listed for a sync with Canvas (UTC)
+    quizzes_synced_at = db.Column(db.DateTime, nullable=True)
 
     def __init__(self, canvas_id, course_name=None):
         self.canvas_id = canvas_id
@@ -58,6 +60,7 @@ class Extension(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     __table_args__ = (
         db.CheckConstraint(percent >= 100, name="check_percent_greater_than_100"),
+        db.UniqueConstraint("course_id", "user_id", name="uq_extension_course_user"),
     )
 
     def __init__(self, course_id, user_id, percent=100):
@@ -77,12 +80,27 @@ class Quiz(db.Model):
     )
     time_limit = db.Column(db.Integer, nullable=True)
     title = db.Column(db.String(250))
-
-    def __init__(self, canvas_id, course_id, title=None, time_limit=None):
+    # Canvas' `updated_at` and a hash of the settings extensions depend on,
+    # as of the last sync. See `utils.quiz_snapshot`.
+    canvas_updated_at = db.Column(db.String(40), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    __table_args__ = (db.Index("ix_quiz_course_canvas", "course_id", "canvas_id"),)
+
+    def __init__(
+        self,
+        canvas_id,
+        course_id,
+        title=None,
+        time_limit=None,
+        canvas_updated_at=None,
+        content_hash=None,
+    ):
         self.canvas_id = canvas_id
         self.course_id = course_id
         self.title = title
         self.time_limit = time_limit
+        self.canvas_updated_at = canvas_updated_at
+        self.content_hash = content_hash
 
 
 # ============================================
@@ -8,8 +8,11 @@ var results_div = document.getElementById("results");
 var new_modal = document.getElementById("new_modal");
 var new_banner = document.getElementById("new_banner");
 var i = 0;
-var update_interval_id = null;
-var refresh_interval_id = null;
+var update_watcher = null;
+var refresh_watcher = null;
+var polled_jobs = {};
+var poll_interval_id = null;
+var roster = null;
 
 $("#new_banner").on("closed.bs.alert", function () {
 	document.cookie = "banner_closed=true"
@@ -54,7 +57,7 @@ $("#selected_user_list").on("click", ".user", function (e) {
 $("#filter_users_button").on("click", function (e) {
 	e.preventDefault();
 	var query = $("#filter_users").val()
-	ajaxFilter(query, update_user_list);
+	filterUsers(query, update_user_list);
 });
 
 $("#percent_select").on("change", function (e) {
@@ -78,8 +81,9 @@ $("#apply_now").on("click", function (e) {
 		url: refresh_url
 	})
 		.done(function (data) {
-			var refresh_job_url = data["refresh_job_url"];
-			refresh_interval_id = setInterval(checkRefresh, 1000, refresh_job_url, true);
+			refresh_watcher = watchJob(data["refresh_job_key"], function (data) {
+				showRefreshStatus(data, true);
+			}, showRefreshError);
 		})
 		.fail(function (data) {
 			// TODO: handle error case
@@ -153,21 +157,104 @@ function clearAlerts() {
 	}
 }
 
-function ajaxFilter(query, callback) {
+function loadRoster(callback) {
 	var xhttp = new XMLHttpRequest();
 
 	user_list_div.innerHTML = "<div id=\"user_list\"><h5 id=\"loader\">Loading...</h5></div>";
 
 	xhttp.onreadystatechange = function () {
 		if (xhttp.readyState == 4 && xhttp.status == 200) {
-			user_list_div.innerHTML = xhttp.responseText;
+			roster = JSON.parse(xhttp.responseText);
+			callback();
 		}
 	};
-	xhttp.onload = callback;
-	xhttp.open("GET", filter_url + "?query=" + query, true);
+	xhttp.open("GET", roster_url, true);
 	xhttp.send();
 }
 
+function searchRoster(query) {
+	// Same ordering as the server: prefix matches first, then substrings
+	query = query.trim().toLowerCase();
+
+	var prefix_matches = [];
+	var substring_matches = [];
+
+	for (var index = 0; index < roster.ids.length; index++) {
+		if (!query) {
+			prefix_matches.push(index);
+			continue;
+		}
+
+		var name = (roster.names[index] || "").toLowerCase();
+		var sis_id = (roster.sis_ids[index] || "").toLowerCase();
+
+		if (name.indexOf(query) === 0 || sis_id.indexOf(query) === 0) {
+			prefix_matches.push(index);
+		}
+		else if (name.indexOf(query) > -1 || sis_id.indexOf(query) > -1) {
+			substring_matches.push(index);
+		}
+	}
+
+	return prefix_matches.concat(substring_matches);
+}
+
+function renderUserList(matches) {
+	// Mirrors templates/user_list.html. Text is set with textContent so
+	// names are escaped.
+	var new_user_list = document.createElement("div");
+	new_user_list.id = "user_list";
+	new_user_list.className = "btn-group-vertical";
+	new_user_list.style.position = "relative";
+
+	if (matches.length >= 10) {
+		var scroll_info_div = document.createElement("div");
+		scroll_info_div.className = "scroll_info_div";
+		var scroll_info = document.createElement("div");
+		scroll_info.className = "text-center text-muted scroll_info";
+		scroll_info.style.fontSize = ".75em";
+		scroll_info.textContent = "\u25BC Scroll for more";
+		scroll_info_div.appendChild(scroll_info);
+		new_user_list.appendChild(scroll_info_div);
+	}
+
+	for (var index = 0; index < matches.length; index++) {
+		var match = matches[index];
+
+		var button = document.createElement("button");
+		button.className = "user btn btn-default";
+		button.setAttribute("data-user-id", roster.ids[match]);
+
+		var name = document.createElement("span");
+		name.className = "pull-left";
+		name.textContent = roster.names[match] || "";
+		button.appendChild(name);
+
+		var sis_id = document.createElement("span");
+		sis_id.className = "pull-right";
+		sis_id.textContent = roster.sis_ids[match] || "";
+		button.appendChild(sis_id);
+
+		new_user_list.appendChild(button);
+	}
+
+	user_list_div.innerHTML = "";
+	user_list_div.appendChild(new_user_list);
+}
+
+function filterUsers(query, callback) {
+	// The roster is fetched once, then every search runs in the browser
+	if (roster === null) {
+		loadRoster(function () {
+			filterUsers(query, callback);
+		});
+		return;
+	}
+
+	renderUserList(searchRoster(query));
+	callback();
+}
+
 function getPercent() {
 	var perc_input = $("#percent_input").val();
 	if (perc_input !== null && perc_input !== "") {
@@ -208,11 +295,10 @@ function ajaxSend() {
 			$("#close_button").prop("disabled", true);
 			$("#close_x").hide();
 
-			var refresh_job_url = data["refresh_job_url"];
-			var update_job_url = data["update_job_url"];
-
-			refresh_interval_id = setInterval(checkRefresh, 1000, refresh_job_url, false);
-			update_interval_id = setInterval(checkUpdate, 1000, update_job_url);
+			refresh_watcher = watchJob(data["refresh_job_key"], function (data) {
+				showRefreshStatus(data, false);
+			}, showRefreshError);
+			update_watcher = watchJob(data["update_job_key"], showUpdateStatus, showUpdateError);
 		})
 		.fail(function (data) {
 			$(update_status).html("<p>Encountered an error. Status " + data["status"] + "</p>");
@@ -224,54 +310,156 @@ function ajaxSend() {
 		});
 }
 
-function checkRefresh(refresh_job_url, refresh_only) {
-	var refresh_div = $("#refresh");
+function watchJob(job_key, on_status, on_error) {
+	// Follows a job's progress. Jobs are polled once a second with one
+	// batched request for all of them, unless the server runs an async
+	// worker and has streaming turned on (job_stream_enabled).
+	var watcher = {
+		stopped: false,
+		source: null
+	};
+
+	watcher.stop = function () {
+		watcher.stopped = true;
+		if (watcher.source) {
+			watcher.source.close();
+		}
+		unpollJob(job_key);
+	};
+
+	function handle(status_code, data) {
+		if (watcher.stopped) {
+			return;
+		}
+		if (status_code >= 400) {
+			watcher.stop();
+			on_error(data);
+		}
+		else {
+			if (status_code != 202) {
+				watcher.stop();
+			}
+			on_status(data);
+		}
+	}
+
+	if (job_stream_enabled && window.EventSource) {
+		watcher.source = new EventSource(jobs_url + job_key + "/stream/");
+		watcher.source.onmessage = function (e) {
+			var event = JSON.parse(e.data);
+			handle(event["status_code"], event["data"]);
+		};
+		watcher.source.onerror = function () {
+			// The browser reconnects dropped streams on its own. Only fall
+			// back to polling when streaming isn't available at all.
+			if (watcher.source.readyState === EventSource.CLOSED && !watcher.stopped) {
+				watcher.source = null;
+				pollJob(job_key, handle);
+			}
+		};
+	}
+	else {
+		pollJob(job_key, handle);
+	}
+
+	return watcher;
+}
+
+function pollJob(job_key, handle) {
+	// All polled jobs share one batched status request per second.
+	polled_jobs[job_key] = handle;
+	if (poll_interval_id === null) {
+		poll_interval_id = setInterval(pollJobs, 1000);
+	}
+}
+
+function unpollJob(job_key) {
+	delete polled_jobs[job_key];
+	if ($.isEmptyObject(polled_jobs) && poll_interval_id !== null) {
+		clearInterval(poll_interval_id);
+		poll_interval_id = null;
+	}
+}
+
+function pollJobs() {
+	var job_keys = Object.keys(polled_jobs);
 	$.ajax({
 		type: "GET",
-		url: refresh_job_url
+		url: jobs_url,
+		data: { job_keys: job_keys.join(",") }
 	})
 		.done(function (data) {
-			percent = data["percent"];
-			refresh_div.find(".status-perc").html(percent.toString() + "%");
-			var prog_bar = refresh_div.find(".progress-bar");
-			prog_bar.attr("aria-valuenow", percent);
-			prog_bar.attr("style", "width: " + percent.toString() + "%;");
-			prog_bar.find("span").text(percent.toString() + "% Complete");
-
-			if (data["status"] == "failed") {
-				prog_bar.addClass("progress-bar-danger");
-				prog_bar.removeClass("progress-bar-info");
-				clearInterval(refresh_interval_id);
-				clearInterval(update_interval_id);
-				refresh_div.find(".status-msg").attr("style", "color: #f00;");
-
-				$("#close_button").prop("disabled", false);
-				$("#close_x").show();
-			}
-			else if (data["status"] == "complete") {
-				prog_bar.addClass("progress-bar-success");
-				prog_bar.removeClass("progress-bar-info");
-				clearInterval(refresh_interval_id);
-				refresh_div.find(".status-msg").attr("style", "color: #000;");
-
-				if (refresh_only === true) {
-					resetModal();
+			job_keys.forEach(function (job_key) {
+				if (polled_jobs[job_key] && data[job_key]) {
+					polled_jobs[job_key](data[job_key]["status_code"], data[job_key]["data"]);
 				}
-			}
-
-			refresh_div.find(".status-msg").html(data["status_msg"]);
+			});
 		})
-		.fail(function (data) {
-			var prog_bar = refresh_div.find(".progress-bar");
+		.fail(function (xhr) {
+			job_keys.forEach(function (job_key) {
+				if (polled_jobs[job_key]) {
+					polled_jobs[job_key](xhr.status || 500, {});
+				}
+			});
+		});
+}
+
+function stopWatching(watcher) {
+	if (watcher) {
+		watcher.stop();
+	}
+}
+
+function showRefreshStatus(data, refresh_only) {
+	var refresh_div = $("#refresh");
 
-			prog_bar.addClass("progress-bar-danger");
-			prog_bar.removeClass("progress-bar-info");
-			clearInterval(refresh_interval_id);
-			clearInterval(update_interval_id);
+	// If there is no data yet, skip
+	if ($.isEmptyObject(data)) {
+		return;
+	}
+
+	percent = data["percent"];
+	refresh_div.find(".status-perc").html(percent.toString() + "%");
+	var prog_bar = refresh_div.find(".progress-bar");
+	prog_bar.attr("aria-valuenow", percent);
+	prog_bar.attr("style", "width: " + percent.toString() + "%;");
+	prog_bar.find("span").text(percent.toString() + "% Complete");
+
+	if (data["status"] == "failed") {
+		prog_bar.addClass("progress-bar-danger");
+		prog_bar.removeClass("progress-bar-info");
+		stopWatching(refresh_watcher);
+		stopWatching(update_watcher);
+		refresh_div.find(".status-msg").attr("style", "color: #f00;");
+
+		$("#close_button").prop("disabled", false);
+		$("#close_x").show();
+	}
+	else if (data["status"] == "complete") {
+		prog_bar.addClass("progress-bar-success");
+		prog_bar.removeClass("progress-bar-info");
+		stopWatching(refresh_watcher);
+		refresh_div.find(".status-msg").attr("style", "color: #000;");
 
-			refresh_div.find(".status-msg").html("<span style=\"color: #f00;\">Failed</span>");
+		if (refresh_only === true) {
 			resetModal();
-		});
+		}
+	}
+
+	refresh_div.find(".status-msg").html(data["status_msg"]);
+}
+
+function showRefreshError(data) {
+	var refresh_div = $("#refresh");
+	var prog_bar = refresh_div.find(".progress-bar");
+
+	prog_bar.addClass("progress-bar-danger");
+	prog_bar.removeClass("progress-bar-info");
+	stopWatching(refresh_watcher);
+	stopWatching(update_watcher);
+
+	refresh_div.find(".status-msg").html("<span style=\"color: #f00;\">Failed</span>");
+	resetModal();
 }
 
 function resetModal() {
@@ -283,63 +471,54 @@ function resetModal() {
 	$("#close_x").show();
 }
 
-function checkUpdate(update_job_url) {
+function showUpdateStatus(data) {
 	var update_div = $("#update");
-	$.ajax({
-		type: "GET",
-		url: update_job_url
-	})
-		.done(function (data) {
 
-			// If there is no data yet, skip
-			if ($.isEmptyObject(data)) {
-				return;
-			}
+	// If there is no data yet, skip
+	if ($.isEmptyObject(data)) {
+		return;
+	}
 
-			percent = data["percent"];
-			update_div.find(".status-perc").html(percent.toString() + "%");
-			var prog_bar = update_div.find(".progress-bar");
-			prog_bar.attr("aria-valuenow", percent);
-			prog_bar.attr("style", "width: " + percent.toString() + "%;");
-			prog_bar.find("span").text(percent.toString() + "% Complete");
-			update_div.find(".status-msg").html(data["status_msg"]);
-
-			if (data["status"] == "failed") {
-				prog_bar.addClass("progress-bar-danger");
-				prog_bar.removeClass("progress-bar-info");
-				clearInterval(update_interval_id);
-				update_div.find(".status-msg").attr("style", "color: #f00;");
-
-				$("#close_button").prop("disabled", false);
-				$("#close_x").show();
-			}
-			else if (data["status"] == "complete") {
-				prog_bar.addClass("progress-bar-success");
-				prog_bar.removeClass("progress-bar-info");
-				clearInterval(update_interval_id);
-				update_div.find(".status-msg").attr("style", "color: #000;");
+	percent = data["percent"];
+	update_div.find(".status-perc").html(percent.toString() + "%");
+	var prog_bar = update_div.find(".progress-bar");
+	prog_bar.attr("aria-valuenow", percent);
+	prog_bar.attr("style", "width: " + percent.toString() + "%;");
+	prog_bar.find("span").text(percent.toString() + "% Complete");
+	update_div.find(".status-msg").html(data["status_msg"]);
+
+	if (data["status"] == "failed") {
+		prog_bar.addClass("progress-bar-danger");
+		prog_bar.removeClass("progress-bar-info");
+		stopWatching(update_watcher);
+		update_div.find(".status-msg").attr("style", "color: #f00;");
+
+		$("#close_button").prop("disabled", false);
+		$("#close_x").show();
+	}
+	else if (data["status"] == "complete") {
+		prog_bar.addClass("progress-bar-success");
+		prog_bar.removeClass("progress-bar-info");
+		stopWatching(update_watcher);
+		update_div.find(".status-msg").attr("style", "color: #000;");
 
-				updateResultTable(data["status_msg"], data["quiz_list"], data["unchanged_list"]);
+		updateResultTable(data["status_msg"], data["quiz_list"], data["unchanged_list"]);
 
-				resetModal();
-				$("#results_button").show();
-			}
-		})
-		.fail(function (data) {
-			percent = data["percent"];
-			update_div.find(".status_perc").html(percent.toString() + "%");
-			var prog_bar = update_div.find(".progress-bar");
-			prog_bar.attr("aria-valuenow", percent);
-			prog_bar.attr("style", "width: " + percent.toString() + "%;");
-			prog_bar.find("span").text(percent.toString() + "% Complete");
-			update_div.find(".status-msg").html(data["status_msg"]);
-
-			prog_bar.addClass("progress-bar-danger");
-			prog_bar.removeClass("progress-bar-info");
-			clearInterval(update_interval_id);
+		resetModal();
+		$("#results_button").show();
+	}
+}
 
-			resetModal();
-		});
+function showUpdateError(data) {
+	var update_div = $("#update");
+	var prog_bar = update_div.find(".progress-bar");
+	update_div.find(".status-msg").html(data["status_msg"]);
+
+	prog_bar.addClass("progress-bar-danger");
+	prog_bar.removeClass("progress-bar-info");
+	stopWatching(update_watcher);
+
+	resetModal();
 }
 
 function updateResultTable(message, quiz_list, unchanged_quiz_list) {
@@ -436,21 +615,35 @@ function checkIfEmpty() {
 	}
 }
 
+function showMissingAlert(missing) {
+	missing_alert.style.display = missing ? "" : "none";
+	resizeFrame();
+}
+
 function ajax_check_missing_and_stale_quizzes(course_id) {
 	var xhttp = new XMLHttpRequest();
 
 	xhttp.onreadystatechange = function () {
-		if (xhttp.readyState == 4 && xhttp.status == 200) {
-			var response = JSON.parse(xhttp.responseText);
+		if (xhttp.readyState != 4) {
+			return;
+		}
 
-			if (response) {
-				missing_alert.style.display = "";
-				resizeFrame();
-			}
-			else {
-				missing_alert.style.display = "none";
-				resizeFrame();
-			}
+		if (xhttp.status == 200) {
+			showMissingAlert(JSON.parse(xhttp.responseText));
+		}
+		else if (xhttp.status == 202) {
+			// No recent result, so the check is running as a job. It only
+			// needs the final answer, so it always polls with the other jobs.
+			var job_key = JSON.parse(xhttp.responseText)["job_key"];
+			pollJob(job_key, function (status_code, data) {
+				if (status_code == 202) {
+					return;
+				}
+				unpollJob(job_key);
+				if (status_code == 200 && typeof data === "boolean") {
+					showMissingAlert(data);
+				}
+			});
 		}
 	};
 	xhttp.open("GET", missing_and_stale_quizzes_url, true);
@@ -465,7 +658,7 @@ function load_func() {
 	}
 
 	// load initial user list
-	ajaxFilter("", update_user_list);
+	filterUsers("", update_user_list);
 
 	// check for missing quizzes
 	ajax_check_missing_and_stale_quizzes(course_id);
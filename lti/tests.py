@@ -1,14 +1,36 @@
+import json
 import logging
-
+import threading
+import time
+import uuid
+from datetime import datetime
+from unittest import mock
+from urllib.parse import parse_qs
+from urllib.request import urlopen
+
+import config
 import fakeredis
 import flask_testing
 import requests_mock
 import views
-from canvasapi import Canvas
+from Crypto.PublicKey import RSA
 from flask import Flask, session
 from flask_caching import Cache
-from models import Course, Extension, Quiz, User, db
+from models import (
+    Course,
+    Deployment,
+    Extension,
+    Key,
+    KeySet,
+    Quiz,
+    Registration,
+    User,
+    db,
+)
 from rq import Queue, SimpleWorker
+from rq.job import Job, JobStatus
+from utils import make_canvas
+from werkzeug.serving import make_server
 
 # Tests with the suffix "_new" are for testing New Quiz functionality specifically,
 # and are identical to their classic quiz counterparts otherwise.
@@ -21,6 +43,8 @@ from rq import Queue, SimpleWorker
 # Test Category Headers (search these)
 # [LTI TESTS]
 # [HOMEPAGE TESTS]
+# [JOB STATUS TESTS]
+# [REFRESH TESTS]
 # [UPDATE BACKGROUND TESTS]
 # [REFRESH BACKGROUND TESTS]
 # [MISSING AND STALE TESTS]
@@ -39,7 +63,9 @@ class ViewTests(flask_testing.TestCase):
         views.app = app
         views.db.init_app(app)
 
-        views.canvas = Canvas(app.config["TESTING_API_URL"], "DUMMY")
+        views.canvas = make_canvas(
+            app.config["TESTING_API_URL"], "DUMMY", views.canvas_session
+        )
         views.cache = Cache(app)
 
         views.init_views(app)
@@ -105,6 +131,93 @@ class ViewTests(flask_testing.TestCase):
         response = test_func()
         self.assertIn("role to use this tool.", response[0])
 
+    def create_registration(self, client_id="10000000000001"):
+        rsa_key = RSA.generate(2048)
+        key_set = KeySet()
+        db.session.add(key_set)
+        db.session.commit()
+
+        db.session.add(
+            Key(
+                key_set_id=key_set.id,
+                public_key=rsa_key.publickey().exportKey().decode("utf-8"),
+                private_key=rsa_key.exportKey().decode("utf-8"),
+                alg="RS256",
+            )
+        )
+        registration = Registration(
+            issuer="https://canvas.instructure.com",
+            client_id=client_id,
+            platform_login_auth_endpoint="https://sso.canvaslms.com/auth",
+            platform_service_auth_endpoint="https://sso.canvaslms.com/token",
+            platform_jwks_endpoint="https://sso.canvaslms.com/jwks",
+            key_set_id=key_set.id,
+        )
+        db.session.add(registration)
+        db.session.commit()
+
+        db.session.add(
+            Deployment(deployment_id="1:abc", registration_id=registration.id)
+        )
+        db.session.commit()
+
+        return registration
+
+    def test_get_lti_config_cached(self, m):
+        from utils import invalidate_lti_config
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        self.create_registration()
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(
+                views, "lti_config_cache", {"version": None, "built_at": 0}
+            ),
+        ):
+            tool_conf = views.get_lti_config()
+            self.assertIs(views.get_lti_config(), tool_conf)
+            self.assertEqual(
+                tool_conf.find_deployment(
+                    "https://canvas.instructure.com", "1:abc"
+                ).get_deployment_id(),
+                "1:abc",
+            )
+
+            # CLI changes bump the version and force a rebuild
+            invalidate_lti_config(redis_conn)
+            self.assertIsNot(views.get_lti_config(), tool_conf)
+
+    def test_jwks_conditional(self, m):
+        from utils import invalidate_lti_config
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        self.create_registration()
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(
+                views,
+                "lti_config_cache",
+                {"version": None, "built_at": 0, "jwks": None},
+            ),
+        ):
+            response = self.client.get("/jwks/")
+            self.assert_200(response)
+            self.assertEqual(len(response.json["keys"]), 1)
+            self.assertIn("public", response.headers["Cache-Control"])
+            etag = response.headers["ETag"]
+
+            response = self.client.get("/jwks/", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+
+            # A new key invalidates the cached document
+            self.create_registration(client_id="10000000000002")
+            invalidate_lti_config(redis_conn)
+            response = self.client.get("/jwks/", headers={"If-None-Match": etag})
+            self.assert_200(response)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
     # [HOMEPAGE TESTS]
 
     def test_index(self, m):
@@ -132,7 +245,8 @@ class ViewTests(flask_testing.TestCase):
         )
 
         course_id = 1
-        response = self.client.get("/filter/{}/".format(course_id))
+        with mock.patch.object(views, "conn", fakeredis.FakeStrictRedis()):
+            response = self.client.get("/filter/{}/".format(course_id))
         self.assert_200(response)
         self.assert_template_used("user_list.html")
         self.assertEqual(len(list(self.get_context_variable("users"))), 0)
@@ -174,11 +288,148 @@ class ViewTests(flask_testing.TestCase):
         )
 
         course_id = 1
-        response = self.client.get("/filter/{}/".format(course_id))
+        with mock.patch.object(views, "conn", fakeredis.FakeStrictRedis()):
+            response = self.client.get("/filter/{}/".format(course_id))
         self.assert_200(response)
         self.assert_template_used("user_list.html")
         self.assertEqual(len(list(self.get_context_variable("users"))), 4)
 
+    def test_filter_cached_roster(self, m):
+        with self.client.session_transaction() as sess:
+            sess["launch_id"] = 12345
+            sess["roles"] = [
+                "http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor"
+            ]
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "title": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {"id": 1, "sortable_name": "Smith, John", "sis_user_id": "JS1"},
+                {"id": 2, "sortable_name": "Doe, Jane", "sis_user_id": "JD2"},
+                {"id": 3, "sortable_name": "Aldersmith, Ann", "sis_user_id": None},
+            ],
+        )
+
+        with (
+            mock.patch.object(views, "conn", fakeredis.FakeStrictRedis()),
+            mock.patch.dict("utils.roster_indexes", clear=True),
+        ):
+            response = self.client.get("/filter/1/?query=smith")
+            self.assert_200(response)
+            # Name prefix matches come before other matches
+            self.assertEqual(
+                [user.id for user in self.get_context_variable("users")], [1, 3]
+            )
+            etag = response.headers["ETag"]
+
+            response = self.client.get("/filter/1/?query=JD")
+            self.assert_200(response)
+            self.assertEqual(
+                [user.id for user in self.get_context_variable("users")], [2]
+            )
+
+            response = self.client.get(
+                "/filter/1/?query=smith", headers={"If-None-Match": etag}
+            )
+            self.assertEqual(response.status_code, 304)
+
+        # The roster was only fetched from Canvas once
+        roster_requests = [
+            req for req in m.request_history if req.path.endswith("/search_users")
+        ]
+        self.assertEqual(len(roster_requests), 1)
+
+    def test_roster(self, m):
+        with self.client.session_transaction() as sess:
+            sess["launch_id"] = 12345
+            sess["roles"] = [
+                "http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor"
+            ]
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "title": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {"id": 1, "sortable_name": "Smith, John", "sis_user_id": "JS1"},
+                {"id": 2, "sortable_name": "Doe, Jane", "sis_user_id": None},
+            ],
+        )
+
+        with (
+            mock.patch.object(views, "conn", fakeredis.FakeStrictRedis()),
+            mock.patch.dict("utils.roster_indexes", clear=True),
+        ):
+            response = self.client.get("/roster/1/")
+            self.assert_200(response)
+            self.assertEqual(
+                response.json,
+                {
+                    "ids": [2, 1],
+                    "names": ["Doe, Jane", "Smith, John"],
+                    "sis_ids": [None, "JS1"],
+                },
+            )
+
+            response = self.client.get(
+                "/roster/1/", headers={"If-None-Match": response.headers["ETag"]}
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_filter_json_paginated(self, m):
+        with self.client.session_transaction() as sess:
+            sess["launch_id"] = 12345
+            sess["roles"] = [
+                "http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor"
+            ]
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "title": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {"id": i, "sortable_name": "Student {:02}".format(i)}
+                for i in range(1, 26)
+            ],
+        )
+
+        with (
+            mock.patch.object(views, "conn", fakeredis.FakeStrictRedis()),
+            mock.patch.dict("utils.roster_indexes", clear=True),
+        ):
+            response = self.client.get("/filter/1/?format=json&limit=10&offset=20")
+
+        self.assert_200(response)
+        self.assertEqual(response.json["total"], 25)
+        self.assertEqual(response.json["limit"], 10)
+        self.assertEqual(
+            [user["id"] for user in response.json["users"]], [21, 22, 23, 24, 25]
+        )
+        self.assertEqual(
+            response.json["users"][0],
+            {"id": 21, "sortable_name": "Student 21", "sis_user_id": None},
+        )
+
     def test_quiz(self, m):
         with self.client.session_transaction() as sess:
             sess["launch_id"] = 12345
@@ -194,6 +445,207 @@ class ViewTests(flask_testing.TestCase):
         self.assert_template_used("userselect.html")
         self.assertEqual(self.get_context_variable("course_id"), str(course_id))
 
+    # [JOB STATUS TESTS]
+
+    def test_job_stream_finished(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+        queue = Queue(is_async=False, connection=redis_conn)
+        job = queue.enqueue_call(func=len, args=([1, 2],))
+
+        with mock.patch.object(views, "conn", redis_conn):
+            response = self.client.get("/jobs/{}/stream/".format(job.id))
+            body = response.get_data(as_text=True)
+
+        self.assert_200(response)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in body.splitlines()
+            if line.startswith("data: ")
+        ]
+        self.assertEqual(events, [{"status_code": 200, "data": 2}])
+
+    def test_job_streams_do_not_block_requests(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+        job = Job.create(func=len, args=([1, 2],), connection=redis_conn)
+        job.save()
+
+        # A single request thread, so a stream that held on to it would
+        # leave nothing for anyone else
+        server = make_server("127.0.0.1", 0, self.app, threaded=False)
+        server_thread = threading.Thread(target=server.serve_forever)
+        base_url = "http://127.0.0.1:{}".format(server.server_port)
+
+        def open_stream():
+            with urlopen("{}/jobs/{}/stream/".format(base_url, job.id)) as response:
+                response.read()
+
+        with mock.patch.object(views, "conn", redis_conn):
+            server_thread.start()
+            try:
+                streams = [threading.Thread(target=open_stream) for _ in range(2)]
+                for stream in streams:
+                    stream.start()
+
+                with urlopen("{}/".format(base_url), timeout=5) as response:
+                    self.assertEqual(response.status, 200)
+
+                for stream in streams:
+                    stream.join(timeout=5)
+                    self.assertFalse(stream.is_alive())
+            finally:
+                server.shutdown()
+                server_thread.join()
+
+    def test_job_status_batch(self, m):
+        from utils import update_job
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        queue = Queue(is_async=False, connection=redis_conn)
+        finished_job = queue.enqueue_call(func=len, args=([1, 2],))
+        pending_job = Job.create(func=len, args=([1, 2],), connection=redis_conn)
+        pending_job.save()
+        update_job(pending_job, 50, "Halfway there", "processing")
+
+        with mock.patch.object(views, "conn", redis_conn):
+            response = self.client.get(
+                "/jobs/?job_keys={},{},fake-job".format(finished_job.id, pending_job.id)
+            )
+
+        self.assert_200(response)
+        self.assertEqual(
+            response.json[finished_job.id], {"status_code": 200, "data": 2}
+        )
+        self.assertEqual(response.json[pending_job.id]["status_code"], 202)
+        self.assertEqual(response.json[pending_job.id]["data"]["percent"], 50)
+        self.assertEqual(response.json["fake-job"]["status_code"], 404)
+        self.assertTrue(response.json["fake-job"]["data"]["error"])
+
+    def test_job_stream_published_progress(self, m):
+        from utils import update_job
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        job = Job.create(func=len, args=([1, 2],), connection=redis_conn)
+        job.save()
+
+        def report_progress():
+            update_job(job, 50, "Halfway there", "processing")
+            update_job(job, 100, "Done", "complete")
+
+        self.app.config["JOB_STREAM_TIMEOUT"] = 5
+        self.app.config["JOB_STREAM_HEARTBEAT"] = 1
+        timer = threading.Timer(0.2, report_progress)
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.dict(self.app.config, {"JOB_STREAM_ENABLED": True}),
+        ):
+            timer.start()
+            response = self.client.get("/jobs/{}/stream/".format(job.id))
+            body = response.get_data(as_text=True)
+        timer.join()
+
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in body.splitlines()
+            if line.startswith("data: ")
+        ]
+        self.assertEqual(events[0], {"status_code": 202, "data": {}})
+        self.assertIn(
+            {
+                "status_code": 202,
+                "data": {
+                    "percent": 50,
+                    "status": "processing",
+                    "status_msg": "Halfway there",
+                    "error": False,
+                },
+            },
+            events,
+        )
+        self.assertEqual(events[-1]["data"]["status"], "complete")
+
+    # [REFRESH TESTS]
+
+    def test_refresh_reuses_in_flight_job(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+        queue = Queue("quizext", connection=redis_conn)
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(views, "q", queue),
+        ):
+            first = self.client.post("/refresh/1/")
+            second = self.client.post("/refresh/1/")
+            other_course = self.client.post("/refresh/2/")
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.json, first.json)
+        self.assertNotEqual(
+            other_course.json["refresh_job_key"], first.json["refresh_job_key"]
+        )
+        # Job keys are random, not derived from the course ID
+        self.assertEqual(uuid.UUID(first.json["refresh_job_key"]).version, 4)
+        self.assertEqual(queue.count, 2)
+        self.assertIsNone(redis_conn.get("quizext:refresh_lock:1"))
+
+    def test_refresh_restarts_finished_job(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+        queue = Queue("quizext", connection=redis_conn)
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(views, "q", queue),
+        ):
+            first = self.client.post("/refresh/1/")
+            job = Job.fetch(first.json["refresh_job_key"], connection=redis_conn)
+            job.set_status(JobStatus.FINISHED)
+            queue.remove(job)
+
+            response = self.client.post("/refresh/1/")
+
+        job_key = response.json["refresh_job_key"]
+        self.assertNotEqual(job_key, first.json["refresh_job_key"])
+        self.assertEqual(
+            Job.fetch(job_key, connection=redis_conn).get_status(), JobStatus.QUEUED
+        )
+        self.assertEqual(queue.count, 1)
+
+    def test_refresh_lock_held(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+        queue = Queue("quizext", connection=redis_conn)
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(views, "q", queue),
+            mock.patch.object(views, "REFRESH_LOCK_WAIT", 0.1),
+        ):
+            first = self.client.post("/refresh/1/")
+            job = Job.fetch(first.json["refresh_job_key"], connection=redis_conn)
+            job.set_status(JobStatus.FINISHED)
+
+            # Another request holds the lock, so its job is used rather than
+            # enqueueing a second one alongside it
+            redis_conn.set("quizext:refresh_lock:1", "other")
+            response = self.client.post("/refresh/1/")
+
+        self.assertEqual(response.json, first.json)
+        self.assertEqual(queue.count, 1)
+        # The other request's lock is left alone
+        self.assertEqual(redis_conn.get("quizext:refresh_lock:1"), b"other")
+
+    def test_release_lock_not_ours(self, m):
+        redis_conn = fakeredis.FakeStrictRedis()
+
+        with mock.patch.object(views, "conn", redis_conn):
+            redis_conn.set("quizext:refresh_lock:1", "other")
+            views.release_lock("quizext:refresh_lock:1", "ours")
+            self.assertEqual(redis_conn.get("quizext:refresh_lock:1"), b"other")
+
+            redis_conn.set("quizext:refresh_lock:1", "ours")
+            views.release_lock("quizext:refresh_lock:1", "ours")
+            self.assertIsNone(redis_conn.get("quizext:refresh_lock:1"))
+
     # [UPDATE BACKGROUND TESTS]
 
     def test_update_background_no_json(self, m):
@@ -311,29 +763,29 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/11".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 11,
-                "name": "Joe Smyth",
-                "sortable_name": "Joe Smyth",
-                "sis_user_id": "JSmyth11",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "active"}
-                ],
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/12".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 12,
-                "name": "Jack Smith",
-                "sortable_name": "Jack Smith",
-                "sis_user_id": "JSmith12",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "active"}
-                ],
-            },
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {
+                    "id": 11,
+                    "name": "Joe Smyth",
+                    "sortable_name": "Joe Smyth",
+                    "sis_user_id": "JSmyth11",
+                    "enrollments": [
+                        {"type": "StudentEnrollment", "enrollment_state": "active"}
+                    ],
+                },
+                {
+                    "id": 12,
+                    "name": "Jack Smith",
+                    "sortable_name": "Jack Smith",
+                    "sis_user_id": "JSmith12",
+                    "enrollments": [
+                        {"type": "StudentEnrollment", "enrollment_state": "active"}
+                    ],
+                },
+            ],
         )
         m.register_uri(
             "GET",
@@ -441,23 +893,23 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/11".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 11,
-                "name": "Joe Smyth",
-                "sortable_name": "Joe Smyth",
-                "sis_user_id": "JSmyth11",
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/12".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 12,
-                "name": "Jack Smith",
-                "sortable_name": "Jack Smith",
-                "sis_user_id": "JSmith12",
-            },
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {
+                    "id": 11,
+                    "name": "Joe Smyth",
+                    "sortable_name": "Joe Smyth",
+                    "sis_user_id": "JSmyth11",
+                },
+                {
+                    "id": 12,
+                    "name": "Jack Smith",
+                    "sortable_name": "Jack Smith",
+                    "sis_user_id": "JSmith12",
+                },
+            ],
         )
         m.register_uri(
             "GET",
@@ -529,29 +981,23 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/11".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 11,
-                "name": "Joe Smyth",
-                "sortable_name": "Joe Smyth",
-                "sis_user_id": "JSmyth11",
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/12".format(self.app.config["TESTING_API_URL"]),
-            status_code=404,
-            json={"errors": [{"message": "The specified resource does not exist."}]},
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/13".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 13,
-                "name": "Jack Smith",
-                "sortable_name": "Jack Smith",
-                "sis_user_id": "JSmith13",
-            },
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {
+                    "id": 11,
+                    "name": "Joe Smyth",
+                    "sortable_name": "Joe Smyth",
+                    "sis_user_id": "JSmyth11",
+                },
+                {
+                    "id": 13,
+                    "name": "Jack Smith",
+                    "sortable_name": "Jack Smith",
+                    "sis_user_id": "JSmith13",
+                },
+            ],
         )
         m.register_uri(
             "POST",
@@ -640,29 +1086,23 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/11".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 11,
-                "name": "Joe Smyth",
-                "sortable_name": "Joe Smyth",
-                "sis_user_id": "JSmyth11",
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/12".format(self.app.config["TESTING_API_URL"]),
-            status_code=404,
-            json={"errors": [{"message": "The specified resource does not exist."}]},
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/13".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 13,
-                "name": "Jack Smith",
-                "sortable_name": "Jack Smith",
-                "sis_user_id": "JSmith13",
-            },
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {
+                    "id": 11,
+                    "name": "Joe Smyth",
+                    "sortable_name": "Joe Smyth",
+                    "sis_user_id": "JSmyth11",
+                },
+                {
+                    "id": 13,
+                    "name": "Jack Smith",
+                    "sortable_name": "Jack Smith",
+                    "sis_user_id": "JSmith13",
+                },
+            ],
         )
         m.register_uri(
             "POST",
@@ -698,10 +1138,9 @@ class ViewTests(flask_testing.TestCase):
 
         views.db.session.commit()
 
+        # user2 has no extension yet, so it is inserted rather than updated
         ext = Extension(course.id, user.id)
         views.db.session.add(ext)
-        ext2 = Extension(course.id, user2.id)
-        views.db.session.add(ext2)
 
         views.db.session.commit()
 
@@ -728,6 +1167,71 @@ class ViewTests(flask_testing.TestCase):
             ),
         )
 
+        # All users are looked up with a single roster request
+        roster_requests = [
+            req for req in m.request_history if req.path.endswith("/search_users")
+        ]
+        self.assertEqual(len(roster_requests), 1)
+        self.assertEqual(User.query.filter_by(canvas_id=13).first().sis_id, "JSmith13")
+        self.assertIsNone(User.query.filter_by(canvas_id=12).first())
+        self.assertEqual(
+            sorted(ext.percent for ext in Extension.query.all()), [200, 200]
+        )
+        self.assertEqual(
+            sorted(quiz.canvas_id for quiz in Quiz.query.all()), [4, 5, 6, 7]
+        )
+        self.assertTrue(all(quiz.content_hash for quiz in Quiz.query.all()))
+        self.assertIsNotNone(Course.query.first().quizzes_synced_at)
+
+        # Each timed quiz costs one request: its extensions are sent without
+        # reading the current ones first
+        quiz_requests = [
+            (req.method, req.path)
+            for req in m.request_history
+            if "/quizzes/" in req.path
+        ]
+        self.assertEqual(
+            sorted(quiz_requests),
+            [
+                ("POST", "/api/v1/courses/1/quizzes/4/extensions"),
+                ("POST", "/api/v1/courses/1/quizzes/5/extensions"),
+            ],
+        )
+
+    def test_update_background_new_quizzes_timeout(self, m):
+        from views import update_background
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[{"id": 11, "name": "Joe Smyth", "sortable_name": "Joe Smyth"}],
+        )
+
+        with mock.patch("views.get_all_quizzes", side_effect=TimeoutError):
+            job = self.queue.enqueue_call(
+                func=update_background,
+                args=(1, {"percent": "200", "user_ids": ["11"]}),
+            )
+            self.worker.work(burst=True)
+
+        job_result = job.return_value()
+        self.assertEqual(job_result["status"], "failed")
+        self.assertTrue(job_result["error"])
+        self.assertEqual(
+            job_result["status_msg"],
+            "Canvas took too long to list this course's New Quizzes, so no "
+            "quizzes were updated. Please try again.",
+        )
+        self.assertFalse([req for req in m.request_history if req.method == "POST"])
+        self.assertIsNone(Course.query.first().quizzes_synced_at)
+
     def test_update_background_new(self, m):
         from views import update_background
 
@@ -767,33 +1271,25 @@ class ViewTests(flask_testing.TestCase):
                 "failed": [],
             },
         )
-
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/11".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 11,
-                "name": "Joe Smyth",
-                "sortable_name": "Joe Smyth",
-                "sis_user_id": "JSmyth11",
-            },
-        )
-
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/1/users/12".format(self.app.config["TESTING_API_URL"]),
-            status_code=404,
-            json={"errors": [{"message": "The specified resource does not exist."}]},
-        )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/13".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 13,
-                "name": "Jack Smith",
-                "sortable_name": "Jack Smith",
-                "sis_user_id": "JSmith13",
-            },
+            "{}api/v1/courses/1/search_users".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[
+                {
+                    "id": 11,
+                    "name": "Joe Smyth",
+                    "sortable_name": "Joe Smyth",
+                    "sis_user_id": "JSmyth11",
+                },
+                {
+                    "id": 13,
+                    "name": "Jack Smith",
+                    "sortable_name": "Jack Smith",
+                    "sis_user_id": "JSmith13",
+                },
+            ],
         )
         m.register_uri(
             "POST",
@@ -910,6 +1406,7 @@ class ViewTests(flask_testing.TestCase):
         self.assertTrue(job_result["error"])
 
     def test_refresh_background_no_missing_and_stale_quizzes(self, m):
+        from utils import get_missing_check, store_missing_check
         from views import refresh_background
 
         with self.client.session_transaction() as sess:
@@ -942,6 +1439,8 @@ class ViewTests(flask_testing.TestCase):
         views.db.session.add(quiz)
         views.db.session.commit()
 
+        store_missing_check(self.queue.connection, course_id, True)
+
         job = self.queue.enqueue_call(func=refresh_background, args=(course_id,))
         self.worker.work(burst=True)
 
@@ -958,10 +1457,43 @@ class ViewTests(flask_testing.TestCase):
         self.assertEqual(job_result["percent"], 100)
         self.assertFalse(job_result["error"])
 
-    def test_refresh_background_update_error(self, m):
+        # The cached banner check is cleared
+        self.assertIsNone(get_missing_check(self.queue.connection, course_id))
+
+    def test_refresh_background_new_quizzes_timeout(self, m):
+        from utils import get_missing_check, store_missing_check
         from views import refresh_background
 
-        with self.client.session_transaction() as sess:
+        course_id = 1
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+
+        store_missing_check(self.queue.connection, course_id, True)
+
+        with mock.patch("utils.get_all_quizzes", side_effect=TimeoutError):
+            job = self.queue.enqueue_call(func=refresh_background, args=(course_id,))
+            self.worker.work(burst=True)
+
+        job_result = job.return_value()
+        self.assertEqual(job_result["status"], "failed")
+        self.assertTrue(job_result["error"])
+        self.assertIn("New Quizzes", job_result["status_msg"])
+
+        # Unlisted New Quizzes may still be stale, so the course isn't synced
+        # and the banner check is kept
+        self.assertIsNone(Course.query.first().quizzes_synced_at)
+        self.assertEqual(
+            get_missing_check(self.queue.connection, course_id), (True, True)
+        )
+
+    def test_refresh_background_update_error(self, m):
+        from views import refresh_background
+
+        with self.client.session_transaction() as sess:
             sess["launch_id"] = 12345
             sess["roles"] = [
                 "http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor"
@@ -989,19 +1521,8 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/12345".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 12345,
-                "sortable_name": "John Smith",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "active"}
-                ],
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/users/12345/enrollments".format(
-                self.app.config["TESTING_API_URL"]
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
             ),
             json=[
                 {
@@ -1096,17 +1617,10 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/users/{}/enrollments".format(
-                self.app.config["TESTING_API_URL"], user_id
-            ),
-            status_code=404,
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/{}/users/{}".format(
-                self.app.config["TESTING_API_URL"], course_id, user_id
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
             ),
-            status_code=404,
+            json=[],
         )
         m.register_uri(
             "GET",
@@ -1140,6 +1654,10 @@ class ViewTests(flask_testing.TestCase):
             "<br>Extensions for the following students are inactive:<br>Missing User",
         )
 
+        # The deactivation is written back to the database
+        views.db.session.expire_all()
+        self.assertFalse(Extension.query.filter_by(id=ext.id).first().active)
+
     def test_refresh_background_inactive_user(self, m):
         from views import refresh_background
 
@@ -1185,8 +1703,8 @@ class ViewTests(flask_testing.TestCase):
         )
         m.register_uri(
             "GET",
-            "{}api/v1/users/{}/enrollments".format(
-                self.app.config["TESTING_API_URL"], user_id
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
             ),
             json=[
                 {
@@ -1197,20 +1715,6 @@ class ViewTests(flask_testing.TestCase):
                 }
             ],
         )
-        m.register_uri(
-            "GET",
-            "{}api/v1/courses/{}/users/{}".format(
-                self.app.config["TESTING_API_URL"], course_id, user_id
-            ),
-            status_code=200,
-            json={
-                "id": user_id,
-                "sortable_name": "John Smith",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "inactive"}
-                ],
-            },
-        )
         m.register_uri(
             "GET",
             "{}api/quiz/v1/courses/1/quizzes?per_page=100".format(
@@ -1286,19 +1790,8 @@ class ViewTests(flask_testing.TestCase):
 
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/12345".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 12345,
-                "sortable_name": "John Smith",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "active"}
-                ],
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/users/12345/enrollments".format(
-                self.app.config["TESTING_API_URL"]
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
             ),
             json=[
                 {
@@ -1324,13 +1817,16 @@ class ViewTests(flask_testing.TestCase):
         user = User(12345, sortable_name="John Smith")
         views.db.session.add(user)
 
+        user_inactive = User(67890, sortable_name="Jane Doe")
+        views.db.session.add(user_inactive)
+
         views.db.session.commit()
 
         ext = Extension(course.id, user.id)
         views.db.session.add(ext)
 
         # Add an inactive extension to be ignored.
-        ext_inactive = Extension(course.id, user.id)
+        ext_inactive = Extension(course.id, user_inactive.id)
         ext_inactive.active = False
         views.db.session.add(ext_inactive)
 
@@ -1349,6 +1845,94 @@ class ViewTests(flask_testing.TestCase):
         self.assertEqual(job_result["status_msg"], "2 quizzes have been updated.")
         self.assertEqual(job_result["percent"], 100)
 
+    def test_refresh_background_reads_extensions_once(self, m):
+        from views import refresh_background
+
+        course_id = 1
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/{}".format(self.app.config["TESTING_API_URL"], course_id),
+            json={"id": course_id, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes".format(self.app.config["TESTING_API_URL"]),
+            json=[{"id": 1, "title": "Quiz 1", "time_limit": 10}],
+        )
+        submissions = m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes/1/submissions".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json={
+                "quiz_submissions": [
+                    {"id": 21, "user_id": 12345, "extra_time": 10},
+                    {"id": 22, "user_id": 67890, "extra_time": 0},
+                ]
+            },
+        )
+        extensions = m.register_uri(
+            "POST",
+            "{}api/v1/courses/1/quizzes/1/extensions".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json={"quiz_extensions": []},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
+            ),
+            json=[
+                {
+                    "id": 222,
+                    "user_id": 12345,
+                    "type": "StudentEnrollment",
+                    "enrollment_state": "active",
+                },
+                {
+                    "id": 223,
+                    "user_id": 67890,
+                    "type": "StudentEnrollment",
+                    "enrollment_state": "active",
+                },
+            ],
+        )
+        m.register_uri(
+            "GET",
+            "{}api/quiz/v1/courses/1/quizzes?per_page=100".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            status_code=500,
+        )
+
+        course = Course(course_id, course_name="Example Course")
+        views.db.session.add(course)
+        user = User(12345, sortable_name="John Smith")
+        views.db.session.add(user)
+        user2 = User(67890, sortable_name="Jane Doe")
+        views.db.session.add(user2)
+        views.db.session.commit()
+
+        views.db.session.add(Extension(course.id, user.id, percent=200))
+        views.db.session.add(Extension(course.id, user2.id, percent=150))
+        views.db.session.commit()
+
+        job = self.queue.enqueue_call(func=refresh_background, args=(course_id,))
+        self.worker.work(burst=True)
+        self.assertTrue(job.is_finished)
+        self.assertEqual(job.return_value()["status"], "complete")
+
+        # Both percent groups share one read of the quiz's extensions, and
+        # only the student whose time changed is sent
+        self.assertEqual(submissions.call_count, 1)
+        self.assertEqual(extensions.call_count, 1)
+        self.assertEqual(
+            parse_qs(extensions.last_request.text)["quiz_extensions[][user_id]"],
+            ["67890"],
+        )
+
     def test_refresh_background_update_success_new(self, m):
         from views import refresh_background
 
@@ -1405,19 +1989,8 @@ class ViewTests(flask_testing.TestCase):
 
         m.register_uri(
             "GET",
-            "{}api/v1/courses/1/users/12345".format(self.app.config["TESTING_API_URL"]),
-            json={
-                "id": 12345,
-                "sortable_name": "John Smith",
-                "enrollments": [
-                    {"type": "StudentEnrollment", "enrollment_state": "active"}
-                ],
-            },
-        )
-        m.register_uri(
-            "GET",
-            "{}api/v1/users/12345/enrollments".format(
-                self.app.config["TESTING_API_URL"]
+            "{}api/v1/courses/{}/enrollments".format(
+                self.app.config["TESTING_API_URL"], course_id
             ),
             json=[
                 {
@@ -1452,13 +2025,16 @@ class ViewTests(flask_testing.TestCase):
         user = User(12345, sortable_name="John Smith")
         views.db.session.add(user)
 
+        user_inactive = User(67890, sortable_name="Jane Doe")
+        views.db.session.add(user_inactive)
+
         views.db.session.commit()
 
         ext = Extension(course.id, user.id)
         views.db.session.add(ext)
 
         # Add an inactive extension to be ignored.
-        ext_inactive = Extension(course.id, user.id)
+        ext_inactive = Extension(course.id, user_inactive.id)
         ext_inactive.active = False
         views.db.session.add(ext_inactive)
 
@@ -1479,6 +2055,29 @@ class ViewTests(flask_testing.TestCase):
 
     # [MISSING AND STALE TESTS]
 
+    def run_missing_and_stale_check(self, course_id):
+        """
+        Request a course's missing quizzes check, run the job it starts,
+        and return the job's result.
+        """
+        redis_conn = self.queue.connection
+        queue = Queue(connection=redis_conn)
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(views, "q", queue),
+        ):
+            response = self.client.get(
+                "/missing_and_stale_quizzes/{}/".format(course_id)
+            )
+            self.assertEqual(response.status_code, 202)
+
+            SimpleWorker([queue], connection=redis_conn).work(burst=True)
+
+            response = self.client.get(response.json["job_url"])
+            self.assert_200(response)
+            return response.json
+
     def test_missing_and_stale_quizzes_check_no_course(self, m):
         course_id = 1
         response = self.client.get("/missing_and_stale_quizzes/{}/".format(course_id))
@@ -1529,11 +2128,138 @@ class ViewTests(flask_testing.TestCase):
         views.db.session.add(extension)
         views.db.session.commit()
 
-        response = self.client.get("/missing_and_stale_quizzes/{}/".format(course_id))
+        self.assertIs(self.run_missing_and_stale_check(course_id), True)
 
+    def test_missing_and_stale_quizzes_check_cached(self, m):
+        from utils import MISSING_CHECK_KEY
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "title": "Course 1"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes?per_page=100".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json=[{"id": 1, "title": "Quiz 1"}],
+        )
+        m.register_uri(
+            "GET",
+            "{}api/quiz/v1/courses/1/quizzes?per_page=100".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            status_code=500,
+        )
+
+        course = Course(canvas_id=1, course_name="test")
+        views.db.session.add(course)
+        views.db.session.commit()
+        views.db.session.add(Extension(course_id=course.id, user_id=5, percent=200))
+        views.db.session.commit()
+
+        redis_conn = self.queue.connection
+        queue = Queue(connection=redis_conn)
+
+        def quiz_requests():
+            return [req for req in m.request_history if req.path.endswith("/quizzes")]
+
+        with (
+            mock.patch.object(views, "conn", redis_conn),
+            mock.patch.object(views, "q", queue),
+        ):
+            # Without a cached result, the check runs as a job
+            response = self.client.get("/missing_and_stale_quizzes/1/")
+            self.assertEqual(response.status_code, 202)
+            job_key = response.json["job_key"]
+            self.assertEqual(response.json["job_url"], "/jobs/{}/".format(job_key))
+            self.assertEqual(uuid.UUID(job_key).version, 4)
+
+            # Another request while the check is queued shares the same job
+            response = self.client.get("/missing_and_stale_quizzes/1/")
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json["job_key"], job_key)
+            self.assertEqual(len(queue), 1)
+            self.assertEqual(len(quiz_requests()), 0)
+
+            SimpleWorker([queue], connection=redis_conn).work(burst=True)
+            self.assertEqual(len(quiz_requests()), 2)
+
+            response = self.client.get("/jobs/{}/".format(job_key))
+            self.assert_200(response)
+            self.assertIs(response.json, True)
+
+            # Answered from the cache
+            response = self.client.get("/missing_and_stale_quizzes/1/")
+            self.assert_200(response)
+            self.assertEqual(response.data, b"true")
+            self.assertEqual(len(quiz_requests()), 2)
+            self.assertEqual(len(queue), 0)
+
+            # Stale results are still used, but rechecked in the background
+            cached = json.loads(redis_conn.get(MISSING_CHECK_KEY.format(1)))
+            cached["checked_at"] -= config.MISSING_CHECK_TTL
+            redis_conn.set(MISSING_CHECK_KEY.format(1), json.dumps(cached))
+
+            response = self.client.get("/missing_and_stale_quizzes/1/")
+            self.assertEqual(response.data, b"true")
+            self.assertEqual(len(quiz_requests()), 2)
+            self.assertEqual(len(queue), 1)
+
+            # Only one recheck is queued at a time
+            self.client.get("/missing_and_stale_quizzes/1/")
+            self.assertEqual(len(queue), 1)
+
+            SimpleWorker([queue], connection=redis_conn).work(burst=True)
+            self.assertEqual(len(quiz_requests()), 4)
+
+    def test_missing_and_stale_quizzes_check_redis_unavailable(self, m):
+        from redis.exceptions import ConnectionError
+
+        course = Course(canvas_id=1, course_name="test")
+        views.db.session.add(course)
+        views.db.session.commit()
+        views.db.session.add(Extension(course_id=course.id, user_id=5, percent=200))
+        views.db.session.commit()
+
+        # Canvas isn't checked inside the request when Redis is down
+        with mock.patch("views.get_missing_check", side_effect=ConnectionError):
+            response = self.client.get("/missing_and_stale_quizzes/1/")
+        self.assert_200(response)
+        self.assertEqual(response.data, b"false")
+        self.assertEqual(len(m.request_history), 0)
+
+        # A stale result is still served if the recheck can't be queued
+        with (
+            mock.patch("views.get_missing_check", return_value=(True, False)),
+            mock.patch("views.enqueue_missing_check", side_effect=ConnectionError),
+        ):
+            response = self.client.get("/missing_and_stale_quizzes/1/")
         self.assert_200(response)
         self.assertEqual(response.data, b"true")
 
+    def test_missing_and_stale_background_invalidated(self, m):
+        from utils import get_missing_check, invalidate_missing_check
+        from views import missing_and_stale_background
+
+        redis_conn = self.queue.connection
+
+        def check_during_refresh(course_id):
+            # A refresh finishes while the check is talking to Canvas
+            invalidate_missing_check(redis_conn, course_id)
+            return True
+
+        with mock.patch(
+            "views.check_missing_and_stale", side_effect=check_during_refresh
+        ):
+            job = self.queue.enqueue_call(func=missing_and_stale_background, args=(1,))
+            self.worker.work(burst=True)
+
+        self.assertIs(job.return_value(), True)
+        # The out of date result isn't cached
+        self.assertIsNone(get_missing_check(redis_conn, 1))
+
     def test_missing_and_stale_quizzes_check_true_new(self, m):
         m.register_uri(
             "GET",
@@ -1574,10 +2300,7 @@ class ViewTests(flask_testing.TestCase):
         views.db.session.add(extension)
         views.db.session.commit()
 
-        response = self.client.get("/missing_and_stale_quizzes/{}/".format(course_id))
-
-        self.assert_200(response)
-        self.assertEqual(response.data, b"true")
+        self.assertIs(self.run_missing_and_stale_check(course_id), True)
 
     def test_missing_and_stale_quizzes_check_false(self, m):
         m.register_uri(
@@ -1615,10 +2338,7 @@ class ViewTests(flask_testing.TestCase):
         views.db.session.add(extension)
         views.db.session.commit()
 
-        response = self.client.get("/missing_and_stale_quizzes/{}/".format(course_id))
-
-        self.assert_200(response)
-        self.assertEqual(response.data, b"false")
+        self.assertIs(self.run_missing_and_stale_check(course_id), False)
 
     def test_missing_and_stale_quizzes_check_false_new(self, m):
         m.register_uri(
@@ -1665,17 +2385,19 @@ class ViewTests(flask_testing.TestCase):
         views.db.session.add(extension)
         views.db.session.commit()
 
-        response = self.client.get("/missing_and_stale_quizzes/{}/".format(course_id))
-
-        self.assert_200(response)
-        self.assertEqual(response.data, b"false")
+        self.assertIs(self.run_missing_and_stale_check(course_id), False)
 
 
 # Utility Function Testing
 
 # Test Category Headers (search these)
+# [CANVAS SESSION TESTS]
 # [EXTEND QUIZ TESTS]
+# [ENROLLMENT INDEX TESTS]
+# [GET ALL QUIZZES TESTS]
 # [GET OR CREATE TESTS]
+# [BULK UPSERT TESTS]
+# [UPDATE JOB TESTS]
 # [MISSING AND STALE TESTS]
 
 
@@ -1693,7 +2415,9 @@ class UtilTests(flask_testing.TestCase):
         views.app = app
         views.db.init_app(app)
 
-        views.canvas = Canvas(app.config["TESTING_API_URL"], "DUMMY")
+        views.canvas = make_canvas(
+            app.config["TESTING_API_URL"], "DUMMY", views.canvas_session
+        )
         views.cache = Cache(app)
 
         views.init_views(app)
@@ -1714,6 +2438,115 @@ class UtilTests(flask_testing.TestCase):
         views.db.session.remove()
         views.db.drop_all()
 
+    # [CANVAS SESSION TESTS]
+
+    def test_make_canvas(self, m):
+        from utils import make_canvas_session
+
+        session = make_canvas_session(7)
+        adapter = session.get_adapter("https://example.edu/")
+        self.assertIs(adapter, session.get_adapter("http://example.edu/"))
+        self.assertEqual(adapter._pool_maxsize, 7)
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+
+        canvas = make_canvas(self.app.config["TESTING_API_URL"], "DUMMY", session)
+        self.assertEqual(canvas.get_course(1).name, "Example Course")
+        self.assertIs(canvas._Canvas__requester._session, session)
+
+    def test_canvas_session_throttle(self, m):
+        from utils import CANVAS_RATE_LIMIT_KEY, make_canvas_session
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        session = make_canvas_session(1, redis_conn)
+        url = "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"])
+
+        m.register_uri(
+            "GET",
+            url,
+            json={"id": 1},
+            headers={"X-Rate-Limit-Remaining": "500", "X-Request-Cost": "5"},
+        )
+        with mock.patch("utils.time.sleep") as sleep:
+            session.get(url)
+            session.get(url)
+        sleep.assert_not_called()
+        self.assertEqual(float(redis_conn.get(CANVAS_RATE_LIMIT_KEY)), 495)
+
+        # Nearly out: later calls wait, without failing
+        m.register_uri(
+            "GET",
+            url,
+            json={"id": 1},
+            headers={"X-Rate-Limit-Remaining": "80", "X-Request-Cost": "5"},
+        )
+        with mock.patch("utils.time.sleep") as sleep:
+            session.get(url)
+            sleep.assert_not_called()
+            session.get(url)
+        max_delay = config.CANVAS_THROTTLE_MAX_DELAY * (
+            1 - 75 / config.CANVAS_RATE_LIMIT_THRESHOLD
+        )
+        delay = sleep.call_args[0][0]
+        self.assertTrue(max_delay / 2 <= delay <= max_delay)
+
+        # A rate limited call empties the shared bucket
+        m.register_uri(
+            "GET", url, status_code=403, text="403 Forbidden (Rate Limit Exceeded)"
+        )
+        with mock.patch("utils.time.sleep"):
+            session.get(url)
+        self.assertEqual(float(redis_conn.get(CANVAS_RATE_LIMIT_KEY)), 0)
+
+    def test_canvas_session_revalidates_quiz_listing(self, m):
+        from utils import make_canvas_session
+
+        session = make_canvas_session(1, fakeredis.FakeStrictRedis())
+        canvas = make_canvas(self.app.config["TESTING_API_URL"], "DUMMY", session)
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        quizzes_url = "{}api/v1/courses/1/quizzes".format(
+            self.app.config["TESTING_API_URL"]
+        )
+        m.register_uri(
+            "GET",
+            quizzes_url,
+            [
+                {
+                    "json": [{"id": 4, "title": "Quiz 4", "time_limit": 10}],
+                    "headers": {"ETag": 'W/"abc123"'},
+                },
+                {"status_code": 304},
+            ],
+        )
+
+        course = canvas.get_course(1)
+        first = [quiz.id for quiz in course.get_quizzes()]
+        second = [quiz.id for quiz in course.get_quizzes()]
+
+        self.assertEqual(first, [4])
+        self.assertEqual(second, [4])
+
+        listing_requests = [
+            req for req in m.request_history if req.path.endswith("/quizzes")
+        ]
+        self.assertNotIn("If-None-Match", listing_requests[0].headers)
+        self.assertEqual(listing_requests[1].headers["If-None-Match"], 'W/"abc123"')
+
+        # Other endpoints are not cached
+        course_requests = [
+            req for req in m.request_history if req.path.endswith("/courses/1")
+        ]
+        self.assertNotIn("If-None-Match", course_requests[0].headers)
+
     # [EXTEND QUIZ TESTS]
 
     def test_extend_quiz(self, m):
@@ -1761,6 +2594,121 @@ class UtilTests(flask_testing.TestCase):
         )
         self.assertEqual(response["added_time"], 10)
 
+    def test_extend_quiz_retries_transient_errors(self, m):
+        from utils import extend_quiz
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes/2".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 2, "course_id": 1, "title": "A Quiz", "time_limit": 10},
+        )
+        extensions_url = "{}api/v1/courses/1/quizzes/2/extensions".format(
+            self.app.config["TESTING_API_URL"]
+        )
+        m.register_uri(
+            "POST",
+            extensions_url,
+            [
+                {"status_code": 502},
+                {"status_code": 403, "text": "403 Forbidden (Rate Limit Exceeded)"},
+                {"status_code": 200, "json": {"quiz_extensions": []}},
+            ],
+        )
+
+        quiz = views.canvas.get_course(1).get_quiz(2)
+        with mock.patch("utils.time.sleep") as sleep:
+            response = extend_quiz(quiz, False, 200, [1, 2, 3])
+
+        self.assertTrue(response["success"])
+        self.assertEqual(response["attempts"], 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        # Client errors are not retried
+        m.register_uri("POST", extensions_url, status_code=404)
+        with mock.patch("utils.time.sleep") as sleep:
+            response = extend_quiz(quiz, False, 200, [1, 2, 3])
+
+        self.assertFalse(response["success"])
+        self.assertEqual(response["attempts"], 1)
+        sleep.assert_not_called()
+
+        # Transient errors give up after CANVAS_RETRY_ATTEMPTS
+        m.register_uri("POST", extensions_url, status_code=503)
+        with mock.patch("utils.time.sleep"):
+            response = extend_quiz(quiz, False, 200, [1, 2, 3])
+
+        self.assertFalse(response["success"])
+        self.assertEqual(response["attempts"], config.CANVAS_RETRY_ATTEMPTS)
+
+    def test_extend_quiz_skip_unchanged(self, m):
+        from utils import extend_quiz
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes/2".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 2, "course_id": 1, "title": "A Quiz", "time_limit": 10},
+        )
+        submissions = m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes/2/submissions".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json={
+                "quiz_submissions": [
+                    {"id": 21, "user_id": 1, "extra_time": 10},
+                    {"id": 22, "user_id": 2, "extra_time": 5},
+                ]
+            },
+        )
+        extensions = m.register_uri(
+            "POST",
+            "{}api/v1/courses/1/quizzes/2/extensions".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            json={"quiz_extensions": []},
+        )
+
+        quiz = views.canvas.get_course(1).get_quiz(2)
+
+        # User 1 already has the extra time
+        response = extend_quiz(quiz, False, 200, [1, 2, 3], skip_unchanged=True)
+        self.assertTrue(response["success"])
+        self.assertEqual(response["added_time"], 10)
+        self.assertEqual(extensions.call_count, 1)
+        self.assertEqual(
+            parse_qs(extensions.last_request.text)["quiz_extensions[][user_id]"],
+            ["2", "3"],
+        )
+
+        # Nothing to change, so nothing is sent
+        response = extend_quiz(quiz, False, 200, ["1"], skip_unchanged=True)
+        self.assertTrue(response["success"])
+        self.assertEqual(response["attempts"], 0)
+        self.assertEqual(extensions.call_count, 1)
+
+        # Extra time that was already fetched isn't fetched again
+        response = extend_quiz(
+            quiz,
+            False,
+            200,
+            [1, 2],
+            skip_unchanged=True,
+            current_extra_time={"1": 10, "2": 10},
+        )
+        self.assertEqual(response["attempts"], 0)
+        self.assertEqual(extensions.call_count, 1)
+        self.assertEqual(submissions.call_count, 2)
+
     def test_extend_quiz_invalid_response(self, m):
         from utils import extend_quiz
 
@@ -2011,6 +2959,167 @@ class UtilTests(flask_testing.TestCase):
             "New Quiz #2 has no time limit, so there is no time to add.",
         )
 
+    def test_extend_quizzes(self, m):
+        from utils import extend_quizzes
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/quizzes".format(self.app.config["TESTING_API_URL"]),
+            json=[
+                {"id": 2, "course_id": 1, "title": "Quiz 2", "time_limit": 10},
+                {"id": 3, "course_id": 1, "title": "Quiz 3", "time_limit": None},
+                {"id": 4, "course_id": 1, "title": "Quiz 4", "time_limit": 30},
+            ],
+        )
+        for quiz_id in (2, 4):
+            m.register_uri(
+                "POST",
+                "{}api/v1/courses/1/quizzes/{}/extensions".format(
+                    self.app.config["TESTING_API_URL"], quiz_id
+                ),
+                status_code=200,
+                json={"quiz_extensions": []},
+            )
+
+        quizzes = list(views.canvas.get_course(1).get_quizzes())
+        results = list(extend_quizzes(quizzes, 200, [1, 2, 3], max_workers=3))
+
+        self.assertEqual([quiz.id for quiz, response in results], [2, 3, 4])
+        self.assertTrue(all(response["success"] for quiz, response in results))
+        self.assertEqual(
+            [response["added_time"] for quiz, response in results], [10, None, 30]
+        )
+
+    # [ENROLLMENT INDEX TESTS]
+
+    def test_get_enrollment_index(self, m):
+        from utils import get_enrollment_index
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1/enrollments".format(self.app.config["TESTING_API_URL"]),
+            json=[
+                {
+                    "id": 1,
+                    "user_id": 11,
+                    "type": "StudentEnrollment",
+                    "enrollment_state": "active",
+                },
+                {
+                    "id": 2,
+                    "user_id": 12,
+                    "type": "TaEnrollment",
+                    "enrollment_state": "invited",
+                },
+                {
+                    "id": 3,
+                    "user_id": 12,
+                    "type": "StudentEnrollment",
+                    "enrollment_state": "completed",
+                },
+            ],
+        )
+
+        enrollment_index = get_enrollment_index(views.canvas.get_course(1))
+
+        self.assertEqual(enrollment_index[11], ["StudentEnrollment"])
+        self.assertEqual(enrollment_index[12], ["TaEnrollment"])
+        self.assertNotIn(13, enrollment_index)
+        self.assertEqual(m.last_request.qs["state[]"], ["active", "invited"])
+
+    # [SEARCH ROSTER TESTS]
+
+    def test_search_roster_index_cache_bounded(self, m):
+        import utils
+        from utils import RosterStudent, search_roster
+
+        students = [RosterStudent(1, "Smith, John", "JS1")]
+
+        with (
+            mock.patch.dict("utils.roster_indexes", clear=True),
+            mock.patch("utils.ROSTER_INDEX_CACHE_SIZE", 2),
+        ):
+            search_roster(1, "a", students, "smith")
+            search_roster(2, "a", students, "smith")
+            # Searching course 1 again makes course 2 the least recently used
+            self.assertEqual(search_roster(1, "a", students, "js"), students)
+            search_roster(3, "a", students, "smith")
+            self.assertEqual(list(utils.roster_indexes), [(1, "a"), (3, "a")])
+
+            # A changed roster gets its own entry
+            search_roster(3, "b", students, "smith")
+            self.assertEqual(list(utils.roster_indexes), [(3, "a"), (3, "b")])
+
+    # [GET ALL QUIZZES TESTS]
+
+    def test_get_all_quizzes_new_quizzes_timeout(self, m):
+        from utils import get_all_quizzes
+
+        release = threading.Event()
+
+        def slow_new_quizzes():
+            release.wait(5)
+            return []
+
+        course_obj = mock.Mock()
+        course_obj.get_quizzes.return_value = [mock.Mock(id=4, time_limit=10)]
+        course_obj.get_new_quizzes.side_effect = slow_new_quizzes
+
+        try:
+            with (
+                mock.patch.object(config, "NEW_QUIZZES_TIMEOUT", 0.05),
+                self.assertRaises(TimeoutError),
+            ):
+                get_all_quizzes(course_obj)
+        finally:
+            release.set()
+
+        course_obj.get_new_quizzes.assert_called_once()
+
+    def test_get_all_quizzes_new_quizzes_timeout_includes_classic(self, m):
+        from utils import get_all_quizzes
+
+        release = threading.Event()
+
+        def slow_quizzes():
+            time.sleep(0.6)
+            return [mock.Mock(id=4, time_limit=10)]
+
+        def slow_new_quizzes():
+            release.wait(5)
+            return []
+
+        course_obj = mock.Mock()
+        course_obj.get_quizzes.side_effect = slow_quizzes
+        course_obj.get_new_quizzes.side_effect = slow_new_quizzes
+
+        try:
+            with (
+                mock.patch.object(config, "NEW_QUIZZES_TIMEOUT", 0.5),
+                self.assertRaises(TimeoutError),
+            ):
+                started = time.monotonic()
+                try:
+                    get_all_quizzes(course_obj)
+                finally:
+                    elapsed = time.monotonic() - started
+        finally:
+            release.set()
+
+        # The timeout had already passed when the Classic Quizzes came back,
+        # so there's no further wait for New Quizzes
+        self.assertLess(elapsed, 1.0)
+
     # [GET OR CREATE TESTS]
 
     def test_get_or_create_created(self, m):
@@ -2063,6 +3172,117 @@ class UtilTests(flask_testing.TestCase):
         self.assertEqual(quiz.course_id, course_id)
         self.assertEqual(quiz.title, quiz_title)
 
+    # [BULK UPSERT TESTS]
+
+    def test_bulk_upsert(self, m):
+        from utils import bulk_upsert
+
+        views.db.session.add(User(11, sis_id="JSmyth11", sortable_name="Joe Smyth"))
+        views.db.session.commit()
+
+        bulk_upsert(
+            views.db.session,
+            User,
+            [
+                {"canvas_id": 11, "sis_id": "JSmyth11", "sortable_name": "Smyth, Joe"},
+                {"canvas_id": 12, "sis_id": "JSmith12", "sortable_name": "Smith, Jack"},
+            ],
+            ["canvas_id"],
+        )
+
+        self.assertEqual(User.query.count(), 2)
+        self.assertEqual(
+            User.query.filter_by(canvas_id=11).first().sortable_name, "Smyth, Joe"
+        )
+        self.assertEqual(User.query.filter_by(canvas_id=12).first().sis_id, "JSmith12")
+
+    def test_bulk_upsert_update_columns(self, m):
+        from utils import bulk_upsert
+
+        views.db.session.add(Quiz(canvas_id=5, course_id=1, title="Final Exam"))
+        views.db.session.commit()
+
+        with mock.patch("utils.BULK_UPSERT_BATCH_SIZE", 1):
+            bulk_upsert(
+                views.db.session,
+                Quiz,
+                [
+                    {
+                        "canvas_id": 5,
+                        "course_id": 1,
+                        "title": "Renamed",
+                        "time_limit": 30,
+                    },
+                    {
+                        "canvas_id": 6,
+                        "course_id": 1,
+                        "title": "Midterm",
+                        "time_limit": 10,
+                    },
+                ],
+                ["canvas_id"],
+                update_columns=["time_limit"],
+            )
+
+        quiz = Quiz.query.filter_by(canvas_id=5).first()
+        self.assertEqual(quiz.title, "Final Exam")
+        self.assertEqual(quiz.time_limit, 30)
+        self.assertEqual(Quiz.query.filter_by(canvas_id=6).first().title, "Midterm")
+
+    # [UPDATE JOB TESTS]
+
+    def test_update_job_throttles_progress(self, m):
+        from utils import update_job
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        job = Job.create(func=len, args=([1, 2],), connection=redis_conn)
+        job.save()
+
+        def saved_meta():
+            return Job.fetch(job.id, connection=redis_conn).meta
+
+        with (
+            mock.patch.object(config, "JOB_PROGRESS_INTERVAL", 60),
+            mock.patch.object(config, "JOB_PROGRESS_STEP", 5),
+        ):
+            update_job(job, 0, "Starting...", "started")
+            self.assertEqual(saved_meta()["status"], "started")
+
+            update_job(job, 1, "Quiz 1", "processing")
+            self.assertEqual(saved_meta()["status"], "processing")
+
+            # Small progress changes are only kept in memory
+            update_job(job, 3, "Quiz 2", "processing")
+            self.assertEqual(job.meta["percent"], 3)
+            self.assertEqual(saved_meta()["percent"], 1)
+
+            update_job(job, 6, "Quiz 3", "processing")
+            self.assertEqual(saved_meta()["percent"], 6)
+
+            # Status changes are always written
+            update_job(job, 7, "Done", "complete")
+            self.assertEqual(saved_meta()["status"], "complete")
+            self.assertEqual(saved_meta()["percent"], 7)
+
+    def test_update_job_progress_released_with_job(self, m):
+        import gc
+
+        import utils
+        from utils import update_job
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        job = Job.create(func=len, args=([1, 2],), connection=redis_conn)
+        job.save()
+
+        # The job stops partway, without reaching "complete" or "failed"
+        update_job(job, 10, "Quiz 1", "processing")
+        self.assertIn(job, utils.job_progress)
+        tracked = len(utils.job_progress)
+
+        del job
+        gc.collect()
+        self.assertEqual(len(utils.job_progress), tracked - 1)
+
     # [MISSING AND STALE TESTS]
 
     def test_missing_and_stale_quizzes(self, m):
@@ -2092,6 +3312,7 @@ class UtilTests(flask_testing.TestCase):
             ],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         quiz_obj = Quiz(course_id=1, canvas_id=2, title="Quiz 2")
         views.db.session.add(quiz_obj)
         views.db.session.commit()
@@ -2102,6 +3323,151 @@ class UtilTests(flask_testing.TestCase):
         self.assertEqual(response[0].__getattribute__("title"), "Quiz 1")
         self.assertEqual(response[1].__getattribute__("title"), "Quiz 3")
 
+    def test_missing_and_stale_quizzes_snapshot(self, m):
+        from utils import missing_and_stale_quizzes, quiz_snapshot
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/quiz/v1/courses/1/quizzes?per_page=100".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            status_code=500,
+        )
+        m.register_uri(
+            "GET",
+            f"{self.app.config['TESTING_API_URL']}api/v1/courses/1/quizzes",
+            json=[
+                # Untouched since the last sync
+                {"id": 1, "title": "Quiz 1", "time_limit": 10, "updated_at": "t1"},
+                # Renamed, but the time limit is the same
+                {"id": 2, "title": "Renamed", "time_limit": 20, "updated_at": "t3"},
+                # Time limit changed
+                {"id": 3, "title": "Quiz 3", "time_limit": 45, "updated_at": "t3"},
+            ],
+        )
+
+        views.db.session.add(Course(1, course_name="Example Course"))
+        synced = [
+            mock.Mock(id=1, title="Quiz 1", time_limit=10, updated_at="t1"),
+            mock.Mock(id=2, title="Quiz 2", time_limit=20, updated_at="t1"),
+            mock.Mock(id=3, title="Quiz 3", time_limit=30, updated_at="t1"),
+        ]
+        for quiz in synced:
+            views.db.session.add(Quiz(**quiz_snapshot(quiz, 1)))
+        views.db.session.commit()
+
+        response = missing_and_stale_quizzes(views.canvas, 1)
+        self.assertEqual([quiz.id for quiz in response], [3])
+
+    def test_missing_and_stale_quizzes_synced_at(self, m):
+        from utils import missing_and_stale_quizzes, quiz_snapshot
+
+        m.register_uri(
+            "GET",
+            "{}api/v1/courses/1".format(self.app.config["TESTING_API_URL"]),
+            json={"id": 1, "name": "Example Course"},
+        )
+        m.register_uri(
+            "GET",
+            "{}api/quiz/v1/courses/1/quizzes?per_page=100".format(
+                self.app.config["TESTING_API_URL"]
+            ),
+            status_code=500,
+        )
+        quizzes_url = "{}api/v1/courses/1/quizzes".format(
+            self.app.config["TESTING_API_URL"]
+        )
+        m.register_uri(
+            "GET",
+            quizzes_url,
+            json=[
+                {
+                    "id": 1,
+                    "title": "Quiz 1",
+                    "time_limit": 10,
+                    "updated_at": "2026-10-01T12:00:00Z",
+                },
+                {
+                    "id": 2,
+                    "title": "Quiz 2",
+                    "time_limit": 20,
+                    "updated_at": "2026-10-01T12:00:00Z",
+                },
+            ],
+        )
+
+        course = Course(1, course_name="Example Course")
+        course.quizzes_synced_at = datetime(2026, 10, 2)
+        views.db.session.add(course)
+        views.db.session.commit()
+        for quiz_id, time_limit in [(1, 10), (2, 20)]:
+            synced = mock.Mock(
+                id=quiz_id,
+                title="Quiz {}".format(quiz_id),
+                time_limit=time_limit,
+                updated_at="2026-10-01T12:00:00Z",
+            )
+            views.db.session.add(Quiz(**quiz_snapshot(synced, course.id)))
+        views.db.session.commit()
+
+        # Nothing was edited since the last sync, so no quiz is compared
+        with mock.patch("utils.quiz_content_hash") as content_hash:
+            self.assertEqual(missing_and_stale_quizzes(views.canvas, 1), [])
+        content_hash.assert_not_called()
+
+        # Quiz 2's time limit was changed after the last sync
+        m.register_uri(
+            "GET",
+            quizzes_url,
+            json=[
+                {
+                    "id": 1,
+                    "title": "Quiz 1",
+                    "time_limit": 10,
+                    "updated_at": "2026-10-01T12:00:00Z",
+                },
+                {
+                    "id": 2,
+                    "title": "Quiz 2",
+                    "time_limit": 25,
+                    "updated_at": "2026-10-03T09:30:00Z",
+                },
+            ],
+        )
+        response = missing_and_stale_quizzes(views.canvas, 1)
+        self.assertEqual([quiz.id for quiz in response], [2])
+
+    def test_store_missing_check_after_invalidation(self, m):
+        from utils import (
+            get_missing_check,
+            get_missing_check_generation,
+            invalidate_missing_check,
+            store_missing_check,
+        )
+
+        redis_conn = fakeredis.FakeStrictRedis()
+
+        generation = get_missing_check_generation(redis_conn, 1)
+        self.assertTrue(store_missing_check(redis_conn, 1, True, generation))
+        self.assertEqual(get_missing_check(redis_conn, 1), (True, True))
+
+        # A check that started before an invalidation isn't stored
+        generation = get_missing_check_generation(redis_conn, 1)
+        invalidate_missing_check(redis_conn, 1)
+        self.assertIsNone(get_missing_check(redis_conn, 1))
+        self.assertFalse(store_missing_check(redis_conn, 1, True, generation))
+        self.assertIsNone(get_missing_check(redis_conn, 1))
+
+        # One that started after it is
+        generation = get_missing_check_generation(redis_conn, 1)
+        self.assertTrue(store_missing_check(redis_conn, 1, False, generation))
+        self.assertEqual(get_missing_check(redis_conn, 1), (False, True))
+
     def test_missing_and_stale_quizzes_new(self, m):
         from utils import missing_and_stale_quizzes
 
@@ -2150,6 +3516,7 @@ class UtilTests(flask_testing.TestCase):
             ],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         quiz_obj = Quiz(course_id=1, canvas_id=2, title="Quiz 2", time_limit=0)
         views.db.session.add(quiz_obj)
         views.db.session.commit()
@@ -2183,6 +3550,7 @@ class UtilTests(flask_testing.TestCase):
             json=[{"id": 1, "title": "Quiz 1", "time_limit": None}],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         quiz_obj = Quiz(course_id=1, canvas_id=1, title="Quiz 1")
         views.db.session.add(quiz_obj)
         views.db.session.commit()
@@ -2217,6 +3585,7 @@ class UtilTests(flask_testing.TestCase):
             ],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         #
         quiz1 = Quiz(course_id=1, canvas_id=1, title="Quiz 1", time_limit=60)
         views.db.session.add(quiz1)
@@ -2257,6 +3626,7 @@ class UtilTests(flask_testing.TestCase):
             ],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         quiz_obj = Quiz(course_id=1, canvas_id=2, title="Quiz 2")
         views.db.session.add(quiz_obj)
         views.db.session.commit()
@@ -2293,6 +3663,7 @@ class UtilTests(flask_testing.TestCase):
             ],
         )
 
+        views.db.session.add(Course(1, course_name="Example Course"))
         quiz_obj = Quiz(course_id=1, canvas_id=1, title="Quiz 1")
         views.db.session.add(quiz_obj)
         views.db.session.commit()
@@ -1,20 +1,388 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 import logging
 import math
+import random
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
 from logging.config import dictConfig
+from urllib.parse import urlparse
 
 import config
+import requests
 from canvasapi import Canvas
-from canvasapi.exceptions import CanvasException
+from canvasapi.exceptions import CanvasException, Forbidden, RateLimitExceeded
 from canvasapi.new_quiz import NewQuiz
-from models import Quiz
+from models import Course, Quiz
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import WatchError
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 
 dictConfig(config.LOGGING_CONFIG)
 logger = logging.getLogger("app")
 
+# Redis key holding the version of the LTI configuration tables
+LTI_CONFIG_VERSION_KEY = "quizext:lti_config_version"
 
-def extend_quiz(quiz, is_new: bool, percent, user_id_list):
+# The last progress written to Redis for each running job, see `update_job`.
+# Entries go away with their job objects, even if a job raises partway.
+job_progress = weakref.WeakKeyDictionary()
+
+# The maximum number of rows `bulk_upsert` sends in one statement
+BULK_UPSERT_BATCH_SIZE = 500
+
+# Redis key holding a course's cached student roster, see `get_course_roster`
+ROSTER_CACHE_KEY = "quizext:roster:{}"
+
+# Search indexes built from cached rosters, keyed by (Canvas course ID, ETag)
+# and kept in least recently used order, see `search_roster`
+roster_indexes = OrderedDict()
+roster_indexes_lock = threading.Lock()
+
+# The number of roster search indexes each process keeps in memory
+ROSTER_INDEX_CACHE_SIZE = 32
+
+# Redis key holding the latest rate limit bucket reported by Canvas
+CANVAS_RATE_LIMIT_KEY = "quizext:canvas_rate_limit_remaining"
+
+# Seconds before a reported rate limit is considered stale. Canvas refills the
+# bucket continuously, so an old reading only underestimates what is left.
+CANVAS_RATE_LIMIT_TTL = 10
+
+# Redis key holding a cached Canvas response, see `CanvasSession`
+CANVAS_HTTP_CACHE_KEY = "quizext:http_cache:{}"
+
+# Canvas GET endpoints whose responses are cached and revalidated
+CANVAS_CACHED_PATHS = re.compile(r"/api/(v1|quiz/v1)/courses/[^/]+/quizzes/?$")
+
+# Redis key holding a course's cached missing/stale quizzes check result
+MISSING_CHECK_KEY = "quizext:missing_check:{}"
+
+# Redis key counting how often a course's missing/stale quizzes check has been
+# invalidated, so a check that started before an invalidation isn't stored
+MISSING_CHECK_GENERATION_KEY = "quizext:missing_check_generation:{}"
+
+# The quiz settings extensions depend on, hashed into `Quiz.content_hash`
+QUIZ_SNAPSHOT_FIELDS = ("time_limit",)
+
+# A student in a course roster
+RosterStudent = namedtuple("RosterStudent", ["id", "sortable_name", "sis_user_id"])
+
+
+class CanvasSession(requests.Session):
+    """
+    An HTTP session that paces Canvas API calls to stay under Canvas' rate
+    limit.
+
+    After each call, the remaining rate limit reported by Canvas (less the
+    cost of the call, in case the next one costs as much) is stored in
+    Redis, so every worker sees it. Before each call, the session sleeps
+    for longer the further that value is below
+    `CANVAS_RATE_LIMIT_THRESHOLD`, with jitter so waiting workers don't all
+    resume at once.
+
+    Responses from the quiz listing endpoints (`CANVAS_CACHED_PATHS`) are
+    also cached in Redis along with their `ETag` and `Last-Modified`
+    headers. Later requests for the same page are sent as conditional
+    requests, and a `304 Not Modified` answer is served from the cache.
+    """
+
+    def __init__(self, connection=None):
+        """
+        :param connection: The Redis connection shared by the app's
+            workers. Calls are not throttled or cached if this is `None`.
+        :type connection: :class:`redis.Redis`
+        """
+        super().__init__()
+        self.connection = connection
+
+    def send(self, request, **kwargs):
+        cache_key, cached = self.get_cached_response(request)
+        if cached is not None:
+            if cached["etag"]:
+                request.headers.setdefault("If-None-Match", cached["etag"])
+            if cached["last_modified"]:
+                request.headers.setdefault("If-Modified-Since", cached["last_modified"])
+
+        self.throttle()
+        response = super().send(request, **kwargs)
+        self.record_rate_limit(response)
+
+        if cache_key is None:
+            return response
+
+        if response.status_code == 304 and cached is not None:
+            logger.debug("Canvas response not modified: {}".format(request.url))
+            return self.build_cached_response(cached, response)
+
+        if response.status_code == 200:
+            self.cache_response(cache_key, response)
+
+        return response
+
+    def get_cached_response(self, request):
+        """
+        Look up the cached copy of a request's response.
+
+        :param request: The request about to be sent.
+        :type request: :class:`requests.PreparedRequest`
+        :rtype: tuple
+        :returns: The request's cache key, or `None` if the request isn't
+            cacheable, and the cached response, or `None` if there is none.
+        """
+        if (
+            self.connection is None
+            or request.method != "GET"
+            or not CANVAS_CACHED_PATHS.search(urlparse(request.url).path)
+        ):
+            return None, None
+
+        cache_key = CANVAS_HTTP_CACHE_KEY.format(
+            hashlib.sha256(request.url.encode("utf-8")).hexdigest()
+        )
+        try:
+            cached = self.connection.get(cache_key)
+        except RedisConnectionError:
+            return None, None
+
+        return cache_key, json.loads(cached) if cached is not None else None
+
+    def cache_response(self, cache_key, response):
+        """
+        Cache a response that Canvas gave validators for.
+
+        :param cache_key: The request's cache key.
+        :type cache_key: str
+        :param response: A successful response from the Canvas API.
+        :type response: :class:`requests.Response`
+        """
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+
+        cached = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": {
+                name: response.headers[name]
+                for name in ("Content-Type", "Link")
+                if name in response.headers
+            },
+            "body": response.text,
+        }
+        try:
+            self.connection.set(
+                cache_key, json.dumps(cached), ex=config.CANVAS_HTTP_CACHE_TTL
+            )
+        except RedisConnectionError:
+            pass
+
+    def build_cached_response(self, cached, not_modified):
+        """
+        Turn a cached response back into a :class:`requests.Response`.
+
+        :param cached: The cached response.
+        :type cached: dict
+        :param not_modified: The `304 Not Modified` response from Canvas.
+        :type not_modified: :class:`requests.Response`
+        :rtype: :class:`requests.Response`
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(cached["headers"])
+        response.headers.update(
+            {
+                name: value
+                for name, value in not_modified.headers.items()
+                if name.lower().startswith("x-")
+            }
+        )
+        response._content = cached["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        response.connection = not_modified.connection
+        return response
+
+    def throttle(self):
+        """
+        Wait before a call if the shared rate limit bucket is running low.
+        """
+        if self.connection is None:
+            return
+
+        try:
+            remaining = self.connection.get(CANVAS_RATE_LIMIT_KEY)
+        except RedisConnectionError:
+            return
+
+        threshold = config.CANVAS_RATE_LIMIT_THRESHOLD
+        if remaining is None or float(remaining) >= threshold:
+            return
+
+        shortfall = 1 - max(float(remaining), 0) / threshold
+        delay = config.CANVAS_THROTTLE_MAX_DELAY * shortfall
+        logger.debug("Canvas rate limit low, waiting up to {:.2f}s".format(delay))
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def record_rate_limit(self, response):
+        """
+        Share the rate limit reported in a Canvas response with every worker.
+
+        :param response: A response from the Canvas API.
+        :type response: :class:`requests.Response`
+        """
+        if self.connection is None:
+            return
+
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        if response.status_code == 403 and "Rate Limit Exceeded" in response.text:
+            remaining = 0
+        if remaining is None:
+            return
+
+        cost = float(response.headers.get("X-Request-Cost", 0))
+        try:
+            self.connection.set(
+                CANVAS_RATE_LIMIT_KEY,
+                float(remaining) - cost,
+                ex=CANVAS_RATE_LIMIT_TTL,
+            )
+        except RedisConnectionError:
+            pass
+
+
+def make_canvas_session(pool_size, connection=None):
+    """
+    Create an HTTP session for Canvas API traffic.
+
+    Connections (and their TLS sessions) are kept alive and reused by every
+    thread sharing the session, up to `pool_size` at a time.
+
+    :param pool_size: The maximum number of connections to keep open per
+        host.
+    :type pool_size: int
+    :param connection: The Redis connection used to share Canvas' rate
+        limit between workers, see :class:`CanvasSession`.
+    :type connection: :class:`redis.Redis`
+    :rtype: :class:`CanvasSession`
+    """
+    session = CanvasSession(connection)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def make_canvas(api_url, api_key, session):
+    """
+    Create a Canvas API object that sends its requests through `session`.
+
+    :param api_url: The base URL of the Canvas instance.
+    :type api_url: str
+    :param api_key: The API key to authenticate requests with.
+    :type api_key: str
+    :param session: The HTTP session to use, from
+        :func:`make_canvas_session`.
+    :type session: :class:`requests.Session`
+    :rtype: :class:`canvasapi.Canvas`
+    """
+    canvas = Canvas(api_url, api_key)
+    # canvasapi has no public way to supply a session
+    canvas._Canvas__requester._session = session
+    return canvas
+
+
+def is_transient_error(err):
+    """
+    Check whether a failed Canvas call is worth retrying.
+
+    Rate limiting, server errors, timeouts and dropped connections are
+    transient. Other client errors (e.g. 404 or 422) will fail the same way
+    every time.
+
+    :param err: The exception raised by the Canvas call.
+    :type err: Exception
+    :rtype: bool
+    """
+    if isinstance(err, RateLimitExceeded):
+        return True
+    if isinstance(err, Forbidden):
+        # Canvas reports an empty rate limit bucket as a 403
+        return "Rate Limit Exceeded" in str(err)
+    if type(err) is CanvasException:
+        # canvasapi's catch-all for status codes it has no exception for
+        match = re.search(r"status code (\d+)", str(err))
+        return match is not None and (
+            int(match.group(1)) in (408, 429) or int(match.group(1)) >= 500
+        )
+    return isinstance(
+        err,
+        (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def retry_delay(attempt):
+    """
+    Get how long to wait before retrying a Canvas call, with jitter.
+
+    :param attempt: The number of attempts made so far.
+    :type attempt: int
+    :rtype: float
+    :returns: The delay in seconds, between half of and the full
+        exponential backoff for `attempt`, capped at
+        `CANVAS_RETRY_MAX_DELAY`.
+    """
+    delay = min(
+        config.CANVAS_RETRY_BASE_DELAY * 2 ** (attempt - 1),
+        config.CANVAS_RETRY_MAX_DELAY,
+    )
+    return random.uniform(delay / 2, delay)
+
+
+def get_current_extra_time(quiz):
+    """
+    Fetch the extra time each user currently has on a Classic Quiz.
+
+    :param quiz: A Classic Quiz object from Canvas.
+    :type quiz: :class:`canvasapi.quiz.Quiz`
+    :rtype: dict
+    :returns: A dictionary mapping Canvas user IDs (as strings) to their
+        extra time in minutes. Users without a quiz submission are left out.
+    """
+    submissions = quiz.get_submissions(per_page=config.MAX_PER_PAGE)
+    return {
+        str(submission.user_id): getattr(submission, "extra_time", None) or 0
+        for submission in submissions
+    }
+
+
+def extend_quiz(
+    quiz,
+    is_new: bool,
+    percent,
+    user_id_list,
+    skip_unchanged=False,
+    current_extra_time=None,
+):
     """
     Extends a quiz time by a percentage for a list of users.
 
@@ -27,13 +395,24 @@ def extend_quiz(quiz, is_new: bool, percent, user_id_list):
     :type percent: int
     :param user_id_list: A list of Canvas user IDs to add time for.
     :type user_id_list: list
+    :param skip_unchanged: Only send extensions for users whose extra time
+        in Canvas differs from the time being added. Canvas has no way to
+        read New Quiz accommodations, so New Quizzes are always sent in
+        full.
+    :type skip_unchanged: bool
+    :param current_extra_time: The extra time users already have on the
+        quiz, from :func:`get_current_extra_time`. Only used with
+        `skip_unchanged`; when left out, it is fetched from Canvas.
+    :type current_extra_time: dict
     :rtype: dict
-    :returns: A dictionary with three parts:
+    :returns: A dictionary with four parts:
 
         - success `bool` False if there was an error, True otherwise.
         - message `str` A long description of success or failure.
         - added_time `int` The amount of time added in minutes. Returns
         `None` if there was no time added.
+        - attempts `int` The number of times the extensions were sent.
+        Transient errors are retried up to `CANVAS_RETRY_ATTEMPTS` times.
     """
     # Debugging tag for new/classic quiz
     tag = "New" if is_new else "Classic"
@@ -43,42 +422,413 @@ def extend_quiz(quiz, is_new: bool, percent, user_id_list):
 
     if time_limit is None or time_limit < 1:
         msg = tag + " Quiz #{} has no time limit, so there is no time to add."
-        return {"success": True, "message": msg.format(quiz_id), "added_time": None}
+        return {
+            "success": True,
+            "message": msg.format(quiz_id),
+            "added_time": None,
+            "attempts": 0,
+        }
 
     added_time = int(
         math.ceil(time_limit * ((float(percent) - 100) / 100) if percent else 0)
     )
 
+    if skip_unchanged and not is_new:
+        if current_extra_time is None:
+            try:
+                current_extra_time = get_current_extra_time(quiz)
+            except Exception:
+                logger.exception(
+                    "Unable to fetch extensions for Classic Quiz #{}, sending all "
+                    "of them.".format(quiz_id)
+                )
+
+        if current_extra_time is not None:
+            user_id_list = [
+                user_id
+                for user_id in user_id_list
+                if current_extra_time.get(str(user_id)) != added_time
+            ]
+
+            if not user_id_list:
+                msg = "All users already have {} minutes added to " + tag + " Quiz #{}"
+                return {
+                    "success": True,
+                    "message": msg.format(added_time, quiz_id),
+                    "added_time": added_time,
+                    "attempts": 0,
+                }
+
     quiz_extensions = []
 
     for user_id in user_id_list:
         user_extension = {"user_id": user_id, "extra_time": added_time}
         quiz_extensions.append(user_extension)
 
-    try:
-        # Change accomodation function based on if this is a new quiz
-        if is_new:
-            quiz.set_accommodations(quiz_extensions)
-        else:
-            quiz.set_extensions(quiz_extensions)
-    except Exception as err:
-        msg = (
-            "Error creating extension for " + tag + " Quiz #{}. Canvas status code: {}"
-        )
-        return {
-            "success": False,
-            "message": msg.format(quiz_id, err),
-            "added_time": None,
-        }
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # Change accomodation function based on if this is a new quiz
+            if is_new:
+                quiz.set_accommodations(quiz_extensions)
+            else:
+                quiz.set_extensions(quiz_extensions)
+            break
+        except Exception as err:
+            if attempt < config.CANVAS_RETRY_ATTEMPTS and is_transient_error(err):
+                delay = retry_delay(attempt)
+                logger.warning(
+                    "Transient error extending {} Quiz #{} ({}), retrying in "
+                    "{:.1f}s".format(tag, quiz_id, err, delay)
+                )
+                time.sleep(delay)
+                continue
+
+            msg = (
+                "Error creating extension for "
+                + tag
+                + " Quiz #{}. Canvas status code: {}"
+            )
+            return {
+                "success": False,
+                "message": msg.format(quiz_id, err),
+                "added_time": None,
+                "attempts": attempt,
+            }
 
     msg = "Successfully added {} minutes to " + tag + " Quiz #{}"
     return {
         "success": True,
         "message": msg.format(added_time, quiz_id),
         "added_time": added_time,
+        "attempts": attempt,
     }
 
 
+def extend_quizzes(quizzes, percent, user_id_list, max_workers=1, skip_unchanged=False):
+    """
+    Extends a list of quizzes concurrently, yielding results in quiz order.
+
+    Stopping iteration early (e.g. on the first failure) cancels any
+    extensions that have not been sent yet.
+
+    :param quizzes: Quiz objects from Canvas, with `time_limit` set.
+    :type quizzes: list
+    :param percent: The percent of original quiz time to be applied.
+    :type percent: int
+    :param user_id_list: A list of Canvas user IDs to add time for.
+    :type user_id_list: list
+    :param max_workers: The maximum number of quizzes to extend at once.
+    :type max_workers: int
+    :param skip_unchanged: Passed on to :func:`extend_quiz`.
+    :type skip_unchanged: bool
+    :rtype: generator
+    :returns: `(quiz, response)` tuples, where `response` is the result
+        of :func:`extend_quiz` for that quiz.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(
+                extend_quiz,
+                quiz,
+                isinstance(quiz, NewQuiz),
+                percent,
+                user_id_list,
+                skip_unchanged,
+            )
+            for quiz in quizzes
+        ]
+        try:
+            for quiz, future in zip(quizzes, futures):
+                yield quiz, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def bulk_upsert(session, model, rows, index_elements, update_columns=None):
+    """
+    Insert many rows, updating the ones that already exist, in one
+    transaction.
+
+    Rows are sent in batches of `BULK_UPSERT_BATCH_SIZE` using
+    `INSERT ... ON DUPLICATE KEY UPDATE` on MySQL and
+    `INSERT ... ON CONFLICT DO UPDATE` on SQLite and PostgreSQL.
+
+    :param session: SQLAlchemy database session
+    :type session: :class:`sqlalchemy.orm.scoping.scoped_session`
+    :param model: The model to insert into.
+    :type model: :class:`flask_sqlalchemy.Model`
+    :param rows: Dictionaries of column values. Every row must have the
+        same keys.
+    :type rows: list
+    :param index_elements: The columns of the unique key that identifies
+        an existing row.
+    :type index_elements: list
+    :param update_columns: The columns to overwrite on existing rows.
+        Defaults to every column in `rows` outside of `index_elements`.
+    :type update_columns: list
+    """
+    if not rows:
+        return
+
+    if update_columns is None:
+        update_columns = [key for key in rows[0] if key not in index_elements]
+
+    table = model.__table__
+    dialect = session.get_bind().dialect.name
+
+    for start in range(0, len(rows), BULK_UPSERT_BATCH_SIZE):
+        batch = rows[start : start + BULK_UPSERT_BATCH_SIZE]
+
+        if dialect == "mysql":
+            stmt = mysql.insert(table).values(batch)
+            new_values = stmt.inserted
+        else:
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = insert(table).values(batch)
+            new_values = stmt.excluded
+
+        set_ = {column: new_values[column] for column in update_columns}
+        if "last_updated_date" in table.c:
+            # onupdate defaults are not applied to upserts
+            set_["last_updated_date"] = func.now()
+
+        if dialect == "mysql":
+            stmt = stmt.on_duplicate_key_update(**set_)
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+
+        session.execute(stmt)
+
+    session.commit()
+
+
+def get_all_quizzes(course_obj):
+    """
+    Fetch a course's Classic and New Quizzes at the same time.
+
+    New Quizzes might not be implemented on a given installation, so if
+    listing them fails, only Classic Quizzes are returned. New Quizzes are
+    given a `time_limit` in minutes, like Classic Quizzes.
+
+    :param course_obj: The Course object from Canvas.
+    :type course_obj: :class:`canvasapi.course.Course`
+    :raises TimeoutError: If New Quizzes weren't listed within
+        `NEW_QUIZZES_TIMEOUT` seconds. The course may still have New
+        Quizzes, so callers shouldn't treat the Classic Quizzes alone as
+        the full list.
+    :rtype: list
+    :returns: The course's Classic Quizzes followed by its New Quizzes.
+    """
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        new_future = executor.submit(lambda: list(course_obj.get_new_quizzes()))
+        # The timeout counts from when the listing started, not from when
+        # the Classic Quizzes finished.
+        deadline = time.monotonic() + config.NEW_QUIZZES_TIMEOUT
+        quizzes = list(course_obj.get_quizzes())
+
+        try:
+            new_quizzes = new_future.result(timeout=max(0, deadline - time.monotonic()))
+        except CanvasException:
+            logger.error(
+                "Error fetching New Quizzes. Your Canvas installation may not support them."
+            )
+            new_quizzes = []
+        except FutureTimeoutError:
+            msg = "Timed out fetching New Quizzes after {}s.".format(
+                config.NEW_QUIZZES_TIMEOUT
+            )
+            logger.error(msg)
+            raise TimeoutError(msg) from None
+    finally:
+        # Don't hold up the caller for a New Quizzes listing that timed out
+        executor.shutdown(wait=False)
+
+    for new_quiz in new_quizzes:
+        settings = new_quiz.quiz_settings
+        if settings is not None and settings["has_time_limit"]:
+            # Divide by 60 because Canvas stores new quiz timers in seconds
+            new_quiz.time_limit = settings["session_time_limit_in_seconds"] / 60
+        else:
+            new_quiz.time_limit = 0
+
+    return quizzes + new_quizzes
+
+
+def get_course_users(course_obj, user_ids):
+    """
+    Fetch a set of users from a course in a single paginated request.
+
+    :param course_obj: The Course object from Canvas.
+    :type course_obj: :class:`canvasapi.course.Course`
+    :param user_ids: A list of Canvas user IDs to look up.
+    :type user_ids: list
+    :rtype: dict
+    :returns: A dictionary mapping Canvas user IDs to User objects. Users
+        that could not be found in the course are left out.
+    """
+    if not user_ids:
+        return {}
+
+    users = course_obj.get_users(user_ids=user_ids, per_page=config.MAX_PER_PAGE)
+    return {user.id: user for user in users}
+
+
+def fetch_course_roster(course_obj):
+    """
+    Fetch every active or invited student in a course from Canvas.
+
+    :param course_obj: The Course object from Canvas.
+    :type course_obj: :class:`canvasapi.course.Course`
+    :rtype: list
+    :returns: A list of :class:`RosterStudent` records, sorted by name.
+    """
+    users = course_obj.get_users(
+        enrollment_type=["student"],
+        enrollment_state=["active", "invited"],
+        per_page=config.MAX_PER_PAGE,
+    )
+
+    roster = [
+        RosterStudent(
+            user.id,
+            getattr(user, "sortable_name", None) or user.name,
+            getattr(user, "sis_user_id", None),
+        )
+        for user in users
+    ]
+    roster.sort(key=lambda student: student.sortable_name.lower())
+    return roster
+
+
+def get_course_roster(connection, canvas: Canvas, course_id):
+    """
+    Get a course's student roster, using the copy cached in Redis while it
+    is fresh.
+
+    The roster is fetched from Canvas when the cached copy has expired
+    (after `ROSTER_CACHE_TTL` seconds) or Redis is unavailable. Each roster
+    is stamped with an ETag, so a refetched roster that hasn't changed
+    keeps the same ETag and the search index built from it is reused.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    :param canvas: The Canvas API object.
+    :type canvas: Canvas
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: tuple
+    :returns: The roster's ETag and a list of students as returned by
+        :func:`fetch_course_roster`.
+    """
+    key = ROSTER_CACHE_KEY.format(course_id)
+
+    try:
+        cached = connection.get(key)
+    except RedisConnectionError:
+        logger.warning("Redis unavailable, fetching roster without caching.")
+        cached = None
+        connection = None
+
+    if cached is not None:
+        cached = json.loads(cached)
+        return cached["etag"], [RosterStudent(*row) for row in cached["students"]]
+
+    students = fetch_course_roster(canvas.get_course(course_id))
+    body = json.dumps(students, sort_keys=True)
+    etag = hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    if connection is not None:
+        connection.set(
+            key,
+            json.dumps({"etag": etag, "students": students}),
+            ex=config.ROSTER_CACHE_TTL,
+        )
+
+    return etag, students
+
+
+def search_roster(course_id, etag, students, query):
+    """
+    Search a course roster by sortable name or SIS ID.
+
+    Lowercased search indexes are kept in memory for the
+    `ROSTER_INDEX_CACHE_SIZE` most recently searched rosters, keyed by
+    course and ETag. Students whose name or SIS ID starts with the query
+    are listed before those that only contain it.
+
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :param etag: The roster's ETag, from :func:`get_course_roster`.
+    :type etag: str
+    :param students: The roster, from :func:`get_course_roster`.
+    :type students: list
+    :param query: The text to search for. An empty query matches everyone.
+    :type query: str
+    :rtype: list
+    :returns: The matching students, in roster order within each group.
+    """
+    key = (course_id, etag)
+    with roster_indexes_lock:
+        index = roster_indexes.get(key)
+        if index is not None:
+            roster_indexes.move_to_end(key)
+
+    if index is None:
+        index = [
+            (
+                student.sortable_name.lower(),
+                (student.sis_user_id or "").lower(),
+                student,
+            )
+            for student in students
+        ]
+        with roster_indexes_lock:
+            roster_indexes[key] = index
+            while len(roster_indexes) > ROSTER_INDEX_CACHE_SIZE:
+                roster_indexes.popitem(last=False)
+
+    query = query.strip().lower()
+    if not query:
+        return list(students)
+
+    prefix_matches = []
+    substring_matches = []
+    for name, sis_id, student in index:
+        if name.startswith(query) or sis_id.startswith(query):
+            prefix_matches.append(student)
+        elif query in name or query in sis_id:
+            substring_matches.append(student)
+
+    return prefix_matches + substring_matches
+
+
+def get_enrollment_index(course_obj):
+    """
+    Fetch all active and invited enrollments in a course at once.
+
+    :param course_obj: The Course object from Canvas.
+    :type course_obj: :class:`canvasapi.course.Course`
+    :rtype: dict
+    :returns: A dictionary mapping Canvas user IDs to a list of their
+        active or invited enrollment types in the course
+        (e.g. `["StudentEnrollment"]`).
+    """
+    enrollments = course_obj.get_enrollments(
+        state=["active", "invited"], per_page=config.MAX_PER_PAGE
+    )
+
+    enrollment_index = defaultdict(list)
+    for enrollment in enrollments:
+        if enrollment.enrollment_state in ("active", "invited"):
+            enrollment_index[enrollment.user_id].append(enrollment.type)
+
+    return enrollment_index
+
+
 def get_or_create(session, model, **kwargs):
     """
     Simple version of Django's get_or_create for interacting with Models
@@ -98,6 +848,73 @@ def get_or_create(session, model, **kwargs):
         return instance, True
 
 
+def invalidate_lti_config(connection):
+    """
+    Mark every worker's cached LTI configuration as out of date.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    """
+    connection.incr(LTI_CONFIG_VERSION_KEY)
+
+
+def quiz_updated_since(quiz, since):
+    """
+    Check whether Canvas reports a quiz as edited after a point in time.
+
+    :param quiz: A quiz object from Canvas.
+    :type quiz: Quiz | NewQuiz
+    :param since: A naive UTC datetime, like `Course.quizzes_synced_at`.
+    :type since: :class:`datetime.datetime`
+    :rtype: bool
+    :returns: True if the quiz was updated after `since`, or if Canvas
+        doesn't say when it was last updated.
+    """
+    updated_at = getattr(quiz, "updated_at_date", None)
+    if not isinstance(updated_at, datetime):
+        return True
+
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return updated_at > since
+
+
+def quiz_content_hash(quiz):
+    """
+    Hash the settings of a Canvas quiz that extensions depend on.
+
+    :param quiz: A quiz object from Canvas, with `time_limit` set.
+    :type quiz: Quiz | NewQuiz
+    :rtype: str
+    """
+    settings = {field: getattr(quiz, field, None) for field in QUIZ_SNAPSHOT_FIELDS}
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def quiz_snapshot(quiz, course_db_id):
+    """
+    Build the `Quiz` row recording a Canvas quiz as it is now, for
+    :func:`bulk_upsert`.
+
+    :param quiz: A quiz object from Canvas, with `time_limit` set.
+    :type quiz: Quiz | NewQuiz
+    :param course_db_id: The database ID of the quiz's course.
+    :type course_db_id: int
+    :rtype: dict
+    """
+    return {
+        "canvas_id": quiz.id,
+        "course_id": course_db_id,
+        "title": quiz.title,
+        "time_limit": quiz.time_limit,
+        "canvas_updated_at": getattr(quiz, "updated_at", None),
+        "content_hash": quiz_content_hash(quiz),
+    }
+
+
 def missing_and_stale_quizzes(canvas: Canvas, course_id, quickcheck=False):
     """
     Find all quizzes that are in Canvas but not in the database (missing),
@@ -110,43 +927,64 @@ def missing_and_stale_quizzes(canvas: Canvas, course_id, quickcheck=False):
     :param quickcheck: Setting this to `True` will return when the
         first missing or stale quiz is found.
     :type quickcheck: bool
+    :raises TimeoutError: If New Quizzes couldn't be listed in time, see
+        :func:`get_all_quizzes`.
     :rtype: list
     :returns: A list of dictionaries representing missing quizzes. If
         quickcheck is true, only the first missing/stale result is returned.
     """
     course_obj = canvas.get_course(course_id)
-    quizzes = list(course_obj.get_quizzes())
+    all_quizzes = get_all_quizzes(course_obj)
 
-    # New Quizzes might not be implemented on a given installation
-    try:
-        new_quizzes = list(course_obj.get_new_quizzes())
-    except CanvasException:
-        logger.error(
-            "Error fetching New Quizzes. Your Canvas installation may not support them."
+    course = Course.query.filter_by(canvas_id=course_id).first()
+    if course is None:
+        # Nothing has been synced for this course yet
+        return all_quizzes[:1] if quickcheck else all_quizzes
+
+    # Load every known quiz's snapshot in one query rather than one per quiz
+    canvas_ids = [canvas_quiz.id for canvas_quiz in all_quizzes]
+    snapshots = {
+        canvas_id: (time_limit, canvas_updated_at, content_hash)
+        for canvas_id, time_limit, canvas_updated_at, content_hash in (
+            Quiz.query.with_entities(
+                Quiz.canvas_id,
+                Quiz.time_limit,
+                Quiz.canvas_updated_at,
+                Quiz.content_hash,
+            ).filter(Quiz.course_id == course.id, Quiz.canvas_id.in_(canvas_ids))
         )
-        new_quizzes = []
+    }
 
-    all_quizzes = quizzes + new_quizzes
+    # If every quiz was synced and none has been edited in Canvas since the
+    # course's last sync, nothing can be missing or stale. New Quizzes don't
+    # report when they were last updated, so a course with any New Quizzes
+    # never takes this shortcut and is compared quiz by quiz below.
+    synced_at = course.quizzes_synced_at
+    if synced_at is not None and not any(
+        canvas_quiz.id not in snapshots or quiz_updated_since(canvas_quiz, synced_at)
+        for canvas_quiz in all_quizzes
+    ):
+        return []
 
     missing_list = []
 
-    for index, canvas_quiz in enumerate(all_quizzes):
-        # Is true if the quiz is a New Quiz
-        is_new = isinstance(canvas_quiz, NewQuiz)
+    for canvas_quiz in all_quizzes:
+        if canvas_quiz.id not in snapshots:
+            stale = True
+        else:
+            time_limit, canvas_updated_at, content_hash = snapshots[canvas_quiz.id]
+            updated_at = getattr(canvas_quiz, "updated_at", None)
 
-        # Add time_limit attribute to quiz
-        if is_new:
-            settings = canvas_quiz.quiz_settings
-            if settings is not None and settings["has_time_limit"]:
-                # Divide by 60 because Canvas stores new quiz timers in seconds
-                canvas_quiz.time_limit = settings["session_time_limit_in_seconds"] / 60
+            if updated_at is not None and updated_at == canvas_updated_at:
+                # Untouched in Canvas since the last sync
+                stale = False
+            elif content_hash is not None:
+                stale = content_hash != quiz_content_hash(canvas_quiz)
             else:
-                canvas_quiz.time_limit = 0
+                # Synced before snapshots were recorded
+                stale = time_limit != canvas_quiz.time_limit
 
-        quiz = Quiz.query.filter_by(canvas_id=canvas_quiz.id).first()
-
-        # quiz is missing or time limit has changed
-        if not quiz or quiz.time_limit != canvas_quiz.time_limit:
+        if stale:
             missing_list.append(canvas_quiz)
 
             if quickcheck:
@@ -156,10 +994,168 @@ def missing_and_stale_quizzes(canvas: Canvas, course_id, quickcheck=False):
     return missing_list
 
 
+def get_missing_check(connection, course_id):
+    """
+    Get the cached result of the missing/stale quizzes check for a course.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: tuple
+    :returns: Whether quizzes were missing or stale, and whether that
+        result is younger than `MISSING_CHECK_TTL` seconds, or `None` if no
+        result is cached.
+    """
+    cached = connection.get(MISSING_CHECK_KEY.format(course_id))
+    if cached is None:
+        return None
+
+    cached = json.loads(cached)
+    fresh = time.time() - cached["checked_at"] < config.MISSING_CHECK_TTL
+    return cached["missing"], fresh
+
+
+def get_missing_check_generation(connection, course_id):
+    """
+    Get how many times a course's missing/stale quizzes check has been
+    invalidated. Read it before checking, and pass it to
+    :func:`store_missing_check`.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: int
+    """
+    return int(connection.get(MISSING_CHECK_GENERATION_KEY.format(course_id)) or 0)
+
+
+def store_missing_check(connection, course_id, missing, generation=None):
+    """
+    Cache the result of the missing/stale quizzes check for a course.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :param missing: Whether any quizzes were missing or stale.
+    :type missing: bool
+    :param generation: The course's check generation from before the check
+        ran, see :func:`get_missing_check_generation`. If the check has been
+        invalidated since, the result is out of date and isn't stored.
+    :type generation: int
+    :rtype: bool
+    :returns: True if the result was stored.
+    """
+    key = MISSING_CHECK_KEY.format(course_id)
+    value = json.dumps({"missing": missing, "checked_at": time.time()})
+
+    if generation is None:
+        connection.set(key, value, ex=config.MISSING_CHECK_MAX_AGE)
+        return True
+
+    generation_key = MISSING_CHECK_GENERATION_KEY.format(course_id)
+    with connection.pipeline() as pipe:
+        try:
+            pipe.watch(generation_key)
+            if int(pipe.get(generation_key) or 0) != generation:
+                return False
+
+            pipe.multi()
+            pipe.set(key, value, ex=config.MISSING_CHECK_MAX_AGE)
+            pipe.execute()
+        except WatchError:
+            # Invalidated while storing
+            return False
+
+    return True
+
+
+def invalidate_missing_check(connection, course_id):
+    """
+    Discard the cached missing/stale quizzes check for a course, e.g. once
+    a job has brought its quizzes up to date. Checks that are still running
+    won't store their results.
+
+    :param connection: The Redis connection shared by the app's workers.
+    :type connection: :class:`redis.Redis`
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    """
+    generation_key = MISSING_CHECK_GENERATION_KEY.format(course_id)
+
+    pipe = connection.pipeline()
+    pipe.incr(generation_key)
+    pipe.expire(generation_key, config.MISSING_CHECK_MAX_AGE)
+    pipe.delete(MISSING_CHECK_KEY.format(course_id))
+    pipe.execute()
+
+
+def job_channel(job_id):
+    """
+    Get the Redis pub/sub channel that a job's progress is published to.
+
+    :param job_id: The ID of the RQ job.
+    :type job_id: str
+    :rtype: str
+    """
+    return "quizext:job:{}".format(job_id)
+
+
+def record_retries(job, extension_response):
+    """
+    Add any retries made by :func:`extend_quiz` to the job's `retries`
+    count. The count is saved with the job's next progress update.
+
+    :param job: The RQ job sending the extensions.
+    :type job: :class:`rq.job.Job`
+    :param extension_response: The result of :func:`extend_quiz`.
+    :type extension_response: dict
+    """
+    retries = max(extension_response.get("attempts", 1) - 1, 0)
+    job.meta["retries"] = job.meta.get("retries", 0) + retries
+
+
 def update_job(job, percent, status_msg, status, error=False):
+    """
+    Update a job's progress.
+
+    The job's meta is always updated in memory, but progress updates are
+    only written to Redis (and published to the job's channel) every
+    `JOB_PROGRESS_INTERVAL` seconds or `JOB_PROGRESS_STEP` percent. Any
+    change of status is written immediately.
+
+    :param job: The RQ job to update.
+    :type job: :class:`rq.job.Job`
+    :param percent: How far along the job is, from 0 to 100.
+    :type percent: int
+    :param status_msg: A description of what the job is doing.
+    :type status_msg: str
+    :param status: The job's status, e.g. `started`, `processing`,
+        `complete` or `failed`.
+    :type status: str
+    :param error: Whether the job has run into an error.
+    :type error: bool
+    """
     job.meta["percent"] = percent
     job.meta["status"] = status
     job.meta["status_msg"] = status_msg
     job.meta["error"] = error
 
-    job.save()
+    now = time.monotonic()
+    last_status, last_percent, last_written = job_progress.get(job, (None, 0, 0))
+    if (
+        status == last_status
+        and percent - last_percent < config.JOB_PROGRESS_STEP
+        and now - last_written < config.JOB_PROGRESS_INTERVAL
+    ):
+        return
+
+    if status in ("complete", "failed"):
+        job_progress.pop(job, None)
+    else:
+        job_progress[job] = (status, percent, now)
+
+    job.save_meta()
+    job.connection.publish(job_channel(job.id), json.dumps(job.meta))
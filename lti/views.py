@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 import functools
+import hashlib
 import json
 import logging
+import threading
+import time
+import uuid
 from collections import defaultdict
+from contextlib import closing
+from datetime import datetime, timezone
 from logging.config import dictConfig
 from subprocess import call
 from urllib.parse import urlparse
@@ -10,8 +16,7 @@ from urllib.parse import urlparse
 import config
 import redis
 import requests
-from canvasapi import Canvas
-from canvasapi.exceptions import CanvasException, ResourceDoesNotExist
+from canvasapi.exceptions import ResourceDoesNotExist
 from canvasapi.new_quiz import NewQuiz
 from cli import register_cli
 from flask import (
@@ -21,6 +26,7 @@ from flask import (
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_caching import Cache
@@ -40,15 +46,33 @@ from pylti1p3.contrib.flask import (
     FlaskRequest,
 )
 from pylti1p3.tool_config import ToolConfDict
-from redis.exceptions import ConnectionError
+from redis.exceptions import ConnectionError, WatchError
 from rq import Queue, get_current_job
 from rq.exceptions import NoSuchJobError
-from rq.job import Job
+from rq.job import Job, JobStatus
 from sqlalchemy.sql import text
 from utils import (
+    LTI_CONFIG_VERSION_KEY,
+    bulk_upsert,
     extend_quiz,
+    extend_quizzes,
+    get_all_quizzes,
+    get_course_roster,
+    get_course_users,
+    get_current_extra_time,
+    get_enrollment_index,
+    get_missing_check,
+    get_missing_check_generation,
     get_or_create,
+    invalidate_missing_check,
+    job_channel,
+    make_canvas,
+    make_canvas_session,
     missing_and_stale_quizzes,
+    quiz_snapshot,
+    record_retries,
+    search_roster,
+    store_missing_check,
     update_job,
 )
 
@@ -76,6 +100,24 @@ class ReverseProxied(object):
 conn = redis.from_url(config.REDIS_URL)
 q = Queue("quizext", connection=conn)
 
+# Seconds the per-course lock in `enqueue_once` is held for at most
+REFRESH_LOCK_TIMEOUT = 10
+
+# Seconds a request waits for another request's per-course lock. Holding it
+# only takes a few Redis calls, so a long wait means the holder is stuck.
+REFRESH_LOCK_WAIT = 1
+
+# Seconds `enqueue_once` remembers a course's in-flight job
+IN_FLIGHT_JOB_TTL = 86400
+
+# Job statuses that mean a job has not finished yet
+IN_FLIGHT_STATUSES = (
+    JobStatus.QUEUED,
+    JobStatus.STARTED,
+    JobStatus.DEFERRED,
+    JobStatus.SCHEDULED,
+)
+
 app = Flask(__name__)
 
 app.config.from_object("config")
@@ -88,18 +130,86 @@ db.init_app(app)
 migrate = Migrate(app, db)
 register_cli(app)
 
+# Shared by every thread (and job) in this process, so Canvas connections
+# are reused rather than set up for each request
+canvas_session = make_canvas_session(config.CANVAS_POOL_SIZE, conn)
+
 # CanvasAPI requires /api/v1/ to be removed
-canvas = Canvas(config.API_URL, config.API_KEY)
+canvas = make_canvas(config.API_URL, config.API_KEY, canvas_session)
 
 ################################
 # START LTI 1.3 IMPLEMENTATION #
 ################################
 
 
+# Process-local copy of the built LTI configuration, see `get_lti_config`
+lti_config_cache = {"version": None, "built_at": 0, "tool_conf": None, "jwks": None}
+lti_config_lock = threading.Lock()
+
+
 def get_lti_config():
-    registrations = Registration.query.all()
+    """
+    Get the LTI tool configuration, reusing this worker's cached copy while
+    it is still current.
+
+    The cached copy is rebuilt when the version stamp in Redis changes
+    (see :func:`utils.invalidate_lti_config`) or after
+    `LTI_CONFIG_CACHE_TTL` seconds.
+
+    :rtype: :class:`pylti1p3.tool_config.ToolConfDict`
+    """
+    try:
+        version = conn.get(LTI_CONFIG_VERSION_KEY) or b"0"
+    except ConnectionError:
+        logger.warning("Unable to reach Redis. Not caching the LTI configuration.")
+        return build_lti_config()
+
+    with lti_config_lock:
+        if (
+            lti_config_cache["version"] == version
+            and time.monotonic() - lti_config_cache["built_at"]
+            < app.config["LTI_CONFIG_CACHE_TTL"]
+        ):
+            return lti_config_cache["tool_conf"]
+
+    tool_conf = build_lti_config()
+
+    with lti_config_lock:
+        lti_config_cache.update(
+            version=version, built_at=time.monotonic(), tool_conf=tool_conf, jwks=None
+        )
 
-    from collections import defaultdict
+    return tool_conf
+
+
+def get_jwks_document():
+    """
+    Get the tool's serialized JWKS and its ETag.
+
+    The document is serialized once per cached LTI configuration, so it is
+    rebuilt whenever a key set changes.
+
+    :rtype: tuple
+    :returns: A `(body, etag)` tuple.
+    """
+    tool_conf = get_lti_config()
+
+    with lti_config_lock:
+        if lti_config_cache["tool_conf"] is tool_conf and lti_config_cache["jwks"]:
+            return lti_config_cache["jwks"]
+
+    body = json.dumps(tool_conf.get_jwks(), sort_keys=True)
+    jwks = (body, hashlib.sha256(body.encode("utf-8")).hexdigest())
+
+    with lti_config_lock:
+        if lti_config_cache["tool_conf"] is tool_conf:
+            lti_config_cache["jwks"] = jwks
+
+    return jwks
+
+
+def build_lti_config():
+    registrations = Registration.query.all()
 
     settings = defaultdict(list)
     for registration in registrations:
@@ -296,7 +406,13 @@ def init_views(app):
 
     @app.route("/jwks/", methods=["GET"])
     def get_jwks():
-        return get_lti_config().get_jwks()
+        body, etag = get_jwks_document()
+
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["JWKS_MAX_AGE"]
+        return response.make_conditional(request)
 
     def error(exception=None):
         return Response(
@@ -371,7 +487,7 @@ def init_views(app):
 
         # Check API Key
         try:
-            response = requests.get(
+            response = canvas_session.get(
                 "{}users/self".format(config.API_URL),
                 headers={"Authorization": "Bearer " + config.API_KEY},
             )
@@ -420,16 +536,22 @@ def init_views(app):
     @app.route("/refresh/<course_id>/", methods=["POST"])
     def refresh(course_id=None):
         """
-        Creates a new `refresh_background` job.
+        Creates a new `refresh_background` job, or reuses the one already
+        running for this course.
 
         :param course_id: The Canvas ID of the Course.
         :type course_id: int
         :rtype: flask.Response
         :returns: A JSON-formatted response containing a url for the started job.
         """
-        job = q.enqueue_call(func=refresh_background, args=(course_id,))
+        job = enqueue_refresh(course_id)
         return Response(
-            json.dumps({"refresh_job_url": url_for("job_status", job_key=job.id)}),
+            json.dumps(
+                {
+                    "refresh_job_key": job.id,
+                    "refresh_job_url": url_for("job_status", job_key=job.id),
+                }
+            ),
             mimetype="application/json",
             status=202,
         )
@@ -445,7 +567,7 @@ def init_views(app):
         :rtype: flask.Response
         :returns: A JSON-formatted response containing urls for the started jobs.
         """
-        refresh_job = q.enqueue_call(func=refresh_background, args=(course_id,))
+        refresh_job = enqueue_refresh(course_id)
         update_job = q.enqueue_call(
             func=update_background,
             args=(course_id, request.get_json()),
@@ -454,7 +576,9 @@ def init_views(app):
         return Response(
             json.dumps(
                 {
+                    "refresh_job_key": refresh_job.id,
                     "refresh_job_url": url_for("job_status", job_key=refresh_job.id),
+                    "update_job_key": update_job.id,
                     "update_job_url": url_for("job_status", job_key=update_job.id),
                 }
             ),
@@ -462,53 +586,112 @@ def init_views(app):
             status=202,
         )
 
+    @app.route("/jobs/", methods=["GET"])
+    def job_status_batch():
+        """
+        Report the status of several jobs at once.
+
+        Job keys are passed as a comma separated `job_keys` query parameter
+        and fetched from Redis in a single pipeline.
+
+        :rtype: flask.Response
+        :returns: A JSON object mapping each job key to the `status_code`
+            and `data` that `job_status` would return for it.
+        """
+        job_keys = [
+            job_key
+            for job_key in request.args.get("job_keys", "").split(",")
+            if job_key
+        ]
+        jobs = Job.fetch_many(job_keys, connection=conn) if job_keys else []
+
+        statuses = {}
+        for job_key, job in zip(job_keys, jobs):
+            payload, status_code = describe_job(job_key, job)
+            statuses[job_key] = {"status_code": status_code, "data": payload}
+
+        return Response(json.dumps(statuses), mimetype="application/json")
+
     @app.route("/jobs/<job_key>/", methods=["GET"])
     def job_status(job_key):
-        try:
-            job = Job.fetch(job_key, connection=conn)
-        except NoSuchJobError:
-            return Response(
-                json.dumps(
-                    {
-                        "error": True,
-                        "status_msg": "{} is not a valid job key.".format(job_key),
-                    }
-                ),
-                mimetype="application/json",
-                status=404,
-            )
+        payload, status_code = get_job_status(job_key)
+        return Response(
+            json.dumps(payload), mimetype="application/json", status=status_code
+        )
 
-        if job.is_finished:
-            return Response(
-                json.dumps(job.result), mimetype="application/json", status=200
-            )
-        elif job.is_failed:
-            logger.error("Job {} failed.\n{}".format(job_key, job.exc_info))
-            return Response(
-                json.dumps(
-                    {
-                        "error": True,
-                        "status_msg": "Job {} failed to complete.".format(job_key),
-                    }
-                ),
-                mimetype="application/json",
-                status=500,
-            )
-        else:
-            return Response(
-                json.dumps(job.meta), mimetype="application/json", status=202
-            )
+    @app.route("/jobs/<job_key>/stream/", methods=["GET"])
+    def job_stream(job_key):
+        """
+        Stream a job's progress as Server-Sent Events.
+
+        Each event's data is a JSON object with the `status_code` and `data`
+        that `job_status` would have returned at that moment. The stream
+        ends once the job reports that it is complete or has failed, or
+        after `JOB_STREAM_TIMEOUT` seconds.
+
+        Unless `JOB_STREAM_ENABLED` is set, only the current status is sent
+        and the stream closes straight away, so it never ties up a web
+        thread.
+
+        :param job_key: The ID of the RQ job.
+        :type job_key: str
+        :rtype: flask.Response
+        """
+
+        def events():
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(job_channel(job_key))
+            try:
+                deadline = time.monotonic() + app.config["JOB_STREAM_TIMEOUT"]
+                payload, status_code = get_job_status(job_key)
+                yield "retry: 1000\n"
+                yield format_job_event(payload, status_code)
+
+                if not app.config["JOB_STREAM_ENABLED"]:
+                    return
+
+                while status_code == 202 and time.monotonic() < deadline:
+                    message = pubsub.get_message(
+                        timeout=app.config["JOB_STREAM_HEARTBEAT"]
+                    )
+                    if message is None:
+                        # Nothing was published. Check on the job directly in
+                        # case it died without reporting.
+                        payload, status_code = get_job_status(job_key)
+                    else:
+                        payload = json.loads(message["data"])
+
+                    yield format_job_event(payload, status_code)
+
+                    if message and payload.get("status") in ("complete", "failed"):
+                        # The job has reported its outcome. Nothing left to send.
+                        break
+            finally:
+                pubsub.close()
+
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     @app.route("/missing_and_stale_quizzes/<course_id>/", methods=["GET"])
     def missing_and_stale_quizzes_check(course_id):
         """
         Check if there are missing quizzes.
 
+        Recent results are answered from the cache. Otherwise the check
+        runs as a background job, and a 202 response gives its `job_key`
+        and `job_url`; the job's result is the boolean answer. Canvas is
+        never checked inside the request, so without Redis the answer is
+        "false".
+
         :param course_id: The Canvas ID of the Course.
         :type course_id: int
-        :rtype: str
-        :returns: A JSON-formatted string representation of a boolean.
-            "true" if there are missing quizzes, "false" if there are not.
+        :rtype: :class:`flask.Response`
+        :returns: "true" if there are missing quizzes, "false" if there are
+            not, or a 202 response with a JSON object giving the check
+            job's `job_key` and `job_url`.
         """
         course = Course.query.filter_by(canvas_id=course_id).first()
         if course is None:
@@ -520,7 +703,38 @@ def init_views(app):
             # There are no extensions for this course yet. No need to update.
             return "false"
 
-        missing = len(missing_and_stale_quizzes(canvas, course_id, True)) > 0
+        try:
+            cached = get_missing_check(conn, course_id)
+            if cached is None:
+                # Don't hold up a web thread on Canvas; the page follows the job
+                job = enqueue_missing_check(course_id)
+        except ConnectionError:
+            logger.warning("Redis unavailable, skipping the missing quizzes check.")
+            return "false"
+
+        if cached is None:
+            return Response(
+                json.dumps(
+                    {
+                        "job_key": job.id,
+                        "job_url": url_for("job_status", job_key=job.id),
+                    }
+                ),
+                status=202,
+                mimetype="application/json",
+            )
+
+        missing, fresh = cached
+        if not fresh:
+            try:
+                enqueue_missing_check(course_id)
+            except ConnectionError:
+                logger.warning(
+                    "Redis unavailable, not rechecking quizzes for course #{}.".format(
+                        course_id
+                    )
+                )
+
         return json.dumps(missing)
 
     @app.route("/filter/<course_id>/", methods=["GET"])
@@ -529,22 +743,311 @@ def init_views(app):
         """
         Display a filtered and paginated list of students in the course.
 
+        Pass `format=json` to get the students as JSON instead, along with
+        the total number of matches. `limit` and `offset` select a page of
+        the matching students; JSON responses return at most
+        `MAX_PER_PAGE` students at a time.
+
         :param course_id: The Canvas ID of the course to search in
         :type: int
         :rtype: str
-        :returns: A list of students in the course using the template user_list.html.
+        :returns: A list of students in the course using the template
+            user_list.html, or as JSON.
         """
 
-        query = request.args.get("query", "").lower()
+        query = request.args.get("query", "")
+        as_json = request.args.get("format") == "json"
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit = request.args.get("limit", None, type=int)
+        if as_json:
+            max_limit = app.config["MAX_PER_PAGE"]
+            limit = max_limit if limit is None else min(max(limit, 0), max_limit)
 
-        course = canvas.get_course(course_id)
-        user_list = course.get_users(
-            search_term=query,
-            enrollment_type=["student"],
-            enrollment_state=["active", "invited"],
+        etag, students = get_course_roster(conn, canvas, course_id)
+        user_list = search_roster(course_id, etag, students, query)
+
+        total = len(user_list)
+        end = None if limit is None else offset + limit
+        user_list = user_list[offset:end]
+
+        if as_json:
+            response = Response(
+                json.dumps(
+                    {
+                        "users": [student._asdict() for student in user_list],
+                        "total": total,
+                        "offset": offset,
+                        "limit": limit,
+                    }
+                ),
+                mimetype="application/json",
+            )
+        else:
+            response = Response(render_template("user_list.html", users=user_list))
+
+        # Results only change with the roster, so browsers can revalidate
+        response.set_etag(
+            hashlib.sha256(
+                "{}:{}".format(etag, request.query_string.decode()).encode("utf-8")
+            ).hexdigest()
         )
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    @app.route("/roster/<course_id>/", methods=["GET"])
+    @lti_required(role="staff")
+    def roster(course_id=None):
+        """
+        Get every student in the course as columnar JSON, for searching in
+        the browser.
+
+        :param course_id: The Canvas ID of the course
+        :type: int
+        :rtype: str
+        :returns: A JSON object with `ids`, `names` and `sis_ids` arrays,
+            where the values at each index belong to the same student.
+        """
+        etag, students = get_course_roster(conn, canvas, course_id)
+
+        response = Response(
+            json.dumps(
+                {
+                    "ids": [student.id for student in students],
+                    "names": [student.sortable_name for student in students],
+                    "sis_ids": [student.sis_user_id for student in students],
+                }
+            ),
+            mimetype="application/json",
+        )
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def enqueue_refresh(course_id):
+    """
+    Start a `refresh_background` job for a course, unless one is already
+    queued or running.
+
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: :class:`rq.job.Job`
+    :returns: The new or already in-flight refresh job.
+    """
+    return enqueue_once("refresh", course_id, refresh_background)
+
+
+def enqueue_once(name, course_id, func):
+    """
+    Enqueue `func(course_id)` unless the same kind of job is already queued
+    or running for the course.
+
+    Job IDs stay random, since anyone holding one can read the job's
+    result. The ID of the in-flight job is kept in Redis under
+    `quizext:<name>_job:<course_id>`, and a short-lived lock around the
+    check-and-enqueue makes sure simultaneous requests for the same
+    course end up sharing a single job. A request that can't get the lock
+    within `REFRESH_LOCK_WAIT` seconds uses the job the holder points to.
+
+    :param name: The kind of job, e.g. `refresh`.
+    :type name: str
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :param func: The job function. It is called with `course_id`.
+    :type func: function
+    :rtype: :class:`rq.job.Job`
+    :returns: The new or already in-flight job.
+    """
+    job_key = "quizext:{}_job:{}".format(name, course_id)
+    lock_key = "quizext:{}_lock:{}".format(name, course_id)
+    lock_token = uuid.uuid4().hex
+
+    def pointed_job():
+        job_id = conn.get(job_key)
+        if not job_id:
+            return None
+        try:
+            return Job.fetch(job_id.decode("utf-8"), connection=conn)
+        except NoSuchJobError:
+            return None
+
+    deadline = time.monotonic() + REFRESH_LOCK_WAIT
+    while not conn.set(lock_key, lock_token, nx=True, ex=REFRESH_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            # Whoever holds the lock is enqueueing a job; use theirs rather
+            # than racing them for a second one
+            job = pointed_job()
+            if job is not None:
+                logger.warning(
+                    "Timed out waiting for {} lock on #{}, using job {}".format(
+                        name, course_id, job.id
+                    )
+                )
+                return job
+
+            logger.warning(
+                "Timed out waiting for {} lock on #{} with no job to reuse".format(
+                    name, course_id
+                )
+            )
+            return q.enqueue_call(func=func, args=(course_id,))
+        time.sleep(0.05)
 
-        return render_template("user_list.html", users=user_list)
+    try:
+        job = pointed_job()
+        if job is not None and job.get_status(refresh=False) in IN_FLIGHT_STATUSES:
+            logger.info("Reusing in-flight {} job {}".format(name, job.id))
+            return job
+
+        job = q.enqueue_call(func=func, args=(course_id,))
+        conn.set(job_key, job.id, ex=IN_FLIGHT_JOB_TTL)
+        return job
+    finally:
+        release_lock(lock_key, lock_token)
+
+
+def release_lock(lock_key, lock_token):
+    """
+    Release a lock taken with `SET NX`, but only if it is still ours.
+
+    The lock may have expired and been taken by another request since, so
+    the check and the delete run as one transaction: if the key changes
+    after it is read, the delete is dropped.
+
+    :param lock_key: The Redis key of the lock.
+    :type lock_key: str
+    :param lock_token: The value the lock was taken with.
+    :type lock_token: str
+    """
+    with conn.pipeline() as pipe:
+        try:
+            pipe.watch(lock_key)
+            if pipe.get(lock_key) != lock_token.encode("utf-8"):
+                return
+
+            pipe.multi()
+            pipe.delete(lock_key)
+            pipe.execute()
+        except WatchError:
+            # Taken by someone else in the meantime
+            pass
+
+
+def check_missing_and_stale(course_id):
+    """
+    Check Canvas for quizzes that are missing or stale in a course.
+
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: bool
+    :returns: True if any quizzes need extensions applied.
+    """
+    return len(missing_and_stale_quizzes(canvas, course_id, True)) > 0
+
+
+def enqueue_missing_check(course_id):
+    """
+    Start a `missing_and_stale_background` job for a course, unless one is
+    already queued or running.
+
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: :class:`rq.job.Job`
+    :returns: The new or already in-flight check job.
+    """
+    return enqueue_once("missing_check", course_id, missing_and_stale_background)
+
+
+def missing_and_stale_background(course_id):
+    """
+    Recheck a course for missing or stale quizzes and cache the result.
+
+    :param course_id: The Canvas ID of the Course.
+    :type course_id: int
+    :rtype: bool
+    :returns: True if any quizzes need extensions applied.
+    """
+    job = get_current_job()
+
+    # A refresh or update that finishes while this runs invalidates the
+    # result, so it's only stored if the generation hasn't moved on
+    generation = get_missing_check_generation(job.connection, course_id)
+
+    with app.app_context():
+        missing = check_missing_and_stale(course_id)
+
+    store_missing_check(job.connection, course_id, missing, generation)
+    return missing
+
+
+def get_job_status(job_key):
+    """
+    Look up the status of a job.
+
+    :param job_key: The ID of the RQ job.
+    :type job_key: str
+    :rtype: tuple
+    :returns: A `(payload, status_code)` tuple, see :func:`describe_job`.
+    """
+    try:
+        job = Job.fetch(job_key, connection=conn)
+    except NoSuchJobError:
+        job = None
+
+    return describe_job(job_key, job)
+
+
+def describe_job(job_key, job):
+    """
+    Describe a fetched job the way the job status endpoints report it.
+
+    :param job_key: The ID of the RQ job.
+    :type job_key: str
+    :param job: The fetched job, or `None` if it does not exist.
+    :type job: :class:`rq.job.Job`
+    :rtype: tuple
+    :returns: A `(payload, status_code)` tuple. Finished jobs return their
+        result with 200, failed jobs an error with 500, missing jobs an
+        error with 404 and jobs still in progress their meta with 202.
+    """
+    if job is None:
+        return (
+            {
+                "error": True,
+                "status_msg": "{} is not a valid job key.".format(job_key),
+            },
+            404,
+        )
+
+    # The job was just fetched, so its status is already current
+    job_status = job.get_status(refresh=False)
+
+    if job_status == JobStatus.FINISHED:
+        return job.result, 200
+    elif job_status == JobStatus.FAILED:
+        logger.error("Job {} failed.\n{}".format(job_key, job.exc_info))
+        return (
+            {
+                "error": True,
+                "status_msg": "Job {} failed to complete.".format(job_key),
+            },
+            500,
+        )
+    else:
+        return job.meta, 202
+
+
+def format_job_event(payload, status_code):
+    """
+    Format a job status as a Server-Sent Event.
+
+    :rtype: str
+    """
+    return "data: {}\n\n".format(
+        json.dumps({"status_code": status_code, "data": payload})
+    )
 
 
 def update_background(course_id, extension_dict):
@@ -605,52 +1108,64 @@ def update_background(course_id, extension_dict):
         course.course_name = course_name
         db.session.commit()
 
-        for user_id in user_ids:
-            try:
-                canvas_user = course_obj.get_user(user_id)
-                sortable_name = canvas_user.name
+        canvas_users = get_course_users(course_obj, user_ids)
 
-                sis_id = canvas_user.sis_user_id
-
-            except ResourceDoesNotExist:
+        user_rows = []
+        for user_id in user_ids:
+            canvas_user = canvas_users.get(user_id)
+            if canvas_user is None:
                 # Unable to find user. Log and skip them.
                 logger.warning(
                     "Unable to find user #{} in course #{}".format(user_id, course_id)
                 )
                 continue
 
-            user, created = get_or_create(db.session, User, canvas_id=user_id)
-
-            user.sortable_name = sortable_name
-            user.sis_id = sis_id
-
-            db.session.commit()
-
-            # create/update extension
-            extension, created = get_or_create(
-                db.session, Extension, course_id=course.id, user_id=user.id
+            user_rows.append(
+                {
+                    "canvas_id": user_id,
+                    "sortable_name": canvas_user.name,
+                    "sis_id": getattr(canvas_user, "sis_user_id", None),
+                }
             )
-            extension.percent = percent
 
-            db.session.commit()
+        bulk_upsert(db.session, User, user_rows, ["canvas_id"])
 
-        quizzes = list(course_obj.get_quizzes())
+        # create/update extensions
+        found_user_ids = [row["canvas_id"] for row in user_rows]
+        extension_rows = [
+            {"course_id": course.id, "user_id": user_db_id, "percent": percent}
+            for (user_db_id,) in User.query.with_entities(User.id).filter(
+                User.canvas_id.in_(found_user_ids)
+            )
+        ]
+        bulk_upsert(
+            db.session,
+            Extension,
+            extension_rows,
+            ["course_id", "user_id"],
+            update_columns=["percent"],
+        )
 
-        # New Quizzes might not be implemented on a given installation
+        # Quizzes edited in Canvas from here on are newer than this sync
+        synced_at = datetime.now(timezone.utc).replace(tzinfo=None)
         try:
-            new_quizzes = list(course_obj.get_new_quizzes())
-        except CanvasException:
-            logger.error(
-                "Error fetching New Quizzes. Your Canvas installation may not support them."
+            all_quizzes = get_all_quizzes(course_obj)
+        except TimeoutError:
+            update_job(
+                job,
+                0,
+                "Canvas took too long to list this course's New Quizzes, so no "
+                "quizzes were updated. Please try again.",
+                "failed",
+                error=True,
             )
-            new_quizzes = []
-
-        all_quizzes = quizzes + new_quizzes
+            return job.meta
 
         total_quizzes = len(all_quizzes)
 
         quiz_time_list = []
         unchanged_quiz_time_list = []
+        quiz_rows = []
 
         if total_quizzes < 1:
             update_job(
@@ -665,61 +1180,57 @@ def update_background(course_id, extension_dict):
             )
             return job.meta
 
-        for index, quiz in enumerate(all_quizzes):
-            # Is true if the quiz is a New Quiz
-            is_new = isinstance(quiz, NewQuiz)
-
-            # Add time_limit attribute to quiz
-            if is_new:
-                settings = quiz.quiz_settings
-                if settings is not None and settings["has_time_limit"]:
-                    # Divide by 60 because Canvas stores new quiz timers in seconds
-                    quiz.time_limit = settings["session_time_limit_in_seconds"] / 60
-                else:
-                    quiz.time_limit = 0
-
-            quiz_id = quiz.id
-            quiz_title = quiz.title
-
-            comp_perc = int(((float(index)) / float(total_quizzes)) * 100)
-            updating_str = "Updating quiz #{} - {} [{} of {}]"
-            update_job(
-                job,
-                comp_perc,
-                updating_str.format(quiz_id, quiz_title, index + 1, total_quizzes),
-                "processing",
-                error=False,
-            )
-
-            extension_response = extend_quiz(quiz, is_new, percent, user_ids)
-
-            if extension_response.get("success", False) is True:
-                # add/update quiz
-                quiz_obj, created = get_or_create(
-                    db.session, Quiz, canvas_id=quiz_id, course_id=course.id
-                )
-                quiz_obj.title = quiz_title
-                quiz_obj.time_limit = quiz.time_limit
+        extension_results = extend_quizzes(
+            all_quizzes,
+            percent,
+            user_ids,
+            app.config["EXTENSION_CONCURRENCY"],
+            skip_unchanged=app.config["EXTENSION_SKIP_UNCHANGED"],
+        )
 
-                db.session.commit()
+        with closing(extension_results):
+            for index, (quiz, extension_response) in enumerate(extension_results):
+                quiz_id = quiz.id
+                quiz_title = quiz.title
 
-                added_time = extension_response.get("added_time", None)
-                if added_time is not None:
-                    quiz_time_list.append(
-                        {"title": quiz_title, "added_time": added_time}
-                    )
-                else:
-                    unchanged_quiz_time_list.append({"title": quiz_title})
-            else:
+                comp_perc = int(((float(index)) / float(total_quizzes)) * 100)
+                updating_str = "Updating quiz #{} - {} [{} of {}]"
                 update_job(
                     job,
                     comp_perc,
-                    extension_response.get("message", "An unknown error occured."),
-                    "failed",
-                    error=True,
+                    updating_str.format(quiz_id, quiz_title, index + 1, total_quizzes),
+                    "processing",
+                    error=False,
                 )
-                logger.error("Extension failed: {}".format(extension_response))
-                return job.meta
+
+                record_retries(job, extension_response)
+
+                if extension_response.get("success", False) is True:
+                    # add/update quiz, saved in bulk below
+                    quiz_rows.append(quiz_snapshot(quiz, course.id))
+
+                    added_time = extension_response.get("added_time", None)
+                    if added_time is not None:
+                        quiz_time_list.append(
+                            {"title": quiz_title, "added_time": added_time}
+                        )
+                    else:
+                        unchanged_quiz_time_list.append({"title": quiz_title})
+                else:
+                    bulk_upsert(db.session, Quiz, quiz_rows, ["canvas_id"])
+                    update_job(
+                        job,
+                        comp_perc,
+                        extension_response.get("message", "An unknown error occured."),
+                        "failed",
+                        error=True,
+                    )
+                    logger.error("Extension failed: {}".format(extension_response))
+                    return job.meta
+
+        bulk_upsert(db.session, Quiz, quiz_rows, ["canvas_id"])
+        course.quizzes_synced_at = synced_at
+        db.session.commit()
 
         msg_str = (
             "Success! {} {} been updated for {} student(s) to have {}% time. "
@@ -735,10 +1246,10 @@ def update_background(course_id, extension_dict):
             "quizzes have" if len(unchanged_quiz_time_list) != 1 else "quiz has",
         )
 
-        update_job(job, 100, message, "complete", error=False)
         job.meta["quiz_list"] = quiz_time_list
         job.meta["unchanged_list"] = unchanged_quiz_time_list
-        job.save()
+        invalidate_missing_check(job.connection, course_id)
+        update_job(job, 100, message, "complete", error=False)
 
         return job.meta
 
@@ -773,12 +1284,30 @@ def refresh_background(course_id):
 
             return job.meta
 
+        # Quizzes edited in Canvas from here on are newer than this sync
+        synced_at = datetime.now(timezone.utc).replace(tzinfo=None)
+
         # Return both legacy and new quizzes
-        quizzes = missing_and_stale_quizzes(canvas, course_id)
+        try:
+            quizzes = missing_and_stale_quizzes(canvas, course_id)
+        except TimeoutError:
+            # Without every quiz, the course can't be marked as synced
+            update_job(
+                job,
+                0,
+                "Canvas took too long to list this course's New Quizzes, so no "
+                "quizzes were refreshed. Please try again.",
+                "failed",
+                error=True,
+            )
+            return job.meta
 
         num_quizzes = len(quizzes)
 
         if num_quizzes < 1:
+            course.quizzes_synced_at = synced_at
+            db.session.commit()
+            invalidate_missing_check(job.connection, course_id)
             update_job(
                 job,
                 100,
@@ -794,58 +1323,65 @@ def refresh_background(course_id):
         inactive_list = []
 
         update_job(job, 0, "Getting past extensions.", "processing", False)
-        for extension in course.extensions:
+
+        # Index the course's enrollments once rather than looking up each user
+        enrollment_index = get_enrollment_index(course_obj)
+
+        # Load each extension with its user's details in a single query
+        extension_rows = (
+            db.session.query(Extension, User.canvas_id, User.sortable_name)
+            .join(User, Extension.user_id == User.id)
+            .filter(Extension.course_id == course.id)
+            .all()
+        )
+
+        # Extensions to deactivate, written back in bulk below
+        deactivate_ids = []
+
+        for extension, user_canvas_id, sortable_name in extension_rows:
             # If extension is inactive, ignore.
             if not extension.active:
-                inactive_list.append(extension.user.sortable_name)
+                inactive_list.append(sortable_name)
                 logger.debug("Extension #{} is inactive.".format(extension.id))
                 continue
 
-            user_canvas_id = (
-                User.query.filter_by(id=extension.user_id).first().canvas_id
-            )
-
             # Check if user is in course. If not, deactivate extension.
-            try:
-                canvas_user = course_obj.get_user(user_canvas_id)
-
-                # Skip user if not a student. Fixes an edge case where a
-                # student that previously recieved an extension changes roles.
-                enrolls = list(canvas_user.get_enrollments())
-                type_list = [
-                    e.type
-                    for e in enrolls
-                    if e.enrollment_state in ("active", "invited")
-                ]
-                if not any(t == "StudentEnrollment" for t in type_list):
-                    logger.info(
-                        (
-                            "User #{} was found in course #{}, but is not an "
-                            "active student. Deactivating extension #{}. Roles "
-                            "found: {}"
-                        ).format(
-                            user_canvas_id,
-                            course_id,
-                            extension.id,
-                            ", ".join(type_list) if len(enrolls) > 0 else None,
-                        )
-                    )
-                    extension.active = False
-                    db.session.commit()
-                    inactive_list.append(extension.user.sortable_name)
-                    continue
-
-            except ResourceDoesNotExist:
+            if user_canvas_id not in enrollment_index:
                 log_str = "User #{} not in course #{}. Deactivating extension #{}."
                 logger.info(log_str.format(user_canvas_id, course_id, extension.id))
-                extension.active = False
-                db.session.commit()
-                inactive_list.append(extension.user.sortable_name)
+                deactivate_ids.append(extension.id)
+                inactive_list.append(sortable_name)
+                continue
+
+            # Skip user if not a student. Fixes an edge case where a
+            # student that previously recieved an extension changes roles.
+            type_list = enrollment_index[user_canvas_id]
+            if not any(t == "StudentEnrollment" for t in type_list):
+                logger.info(
+                    (
+                        "User #{} was found in course #{}, but is not an "
+                        "active student. Deactivating extension #{}. Roles "
+                        "found: {}"
+                    ).format(
+                        user_canvas_id,
+                        course_id,
+                        extension.id,
+                        ", ".join(type_list),
+                    )
+                )
+                deactivate_ids.append(extension.id)
+                inactive_list.append(sortable_name)
                 continue
 
             # Maps percentage amounts of extensions to their users
             percent_user_map[extension.percent].append(user_canvas_id)
 
+        if deactivate_ids:
+            Extension.query.filter(Extension.id.in_(deactivate_ids)).update(
+                {Extension.active: False}, synchronize_session=False
+            )
+            db.session.commit()
+
         if len(percent_user_map) < 1:
             msg_str = "No active extensions were found.<br>"
             if len(inactive_list) > 0:
@@ -855,6 +1391,8 @@ def refresh_background(course_id):
             update_job(job, 100, msg_str, "complete", error=False)
             return job.meta
 
+        quiz_rows = []
+
         for index, quiz in enumerate(quizzes):
             # Is true if the quiz is a New Quiz
             is_new = isinstance(quiz, NewQuiz)
@@ -872,24 +1410,44 @@ def refresh_background(course_id):
                 error=False,
             )
 
-            for percent, user_list in percent_user_map.items():
-                extension_response = extend_quiz(quiz, is_new, percent, user_list)
-
-                if extension_response.get("success", False) is True:
-                    # add/update quiz
-                    quiz_obj, created = get_or_create(
-                        db.session, Quiz, canvas_id=quiz_id, course_id=course.id
+            # Read the quiz's current extensions once for every percent group.
+            # If they can't be read, all of the extensions are sent.
+            current_extra_time = None
+            if not is_new:
+                try:
+                    current_extra_time = get_current_extra_time(quiz)
+                except Exception:
+                    logger.exception(
+                        "Unable to fetch extensions for Classic Quiz #{}, sending "
+                        "all of them.".format(quiz_id)
                     )
-                    quiz_obj.title = quiz_title
-                    quiz_obj.time_limit = quiz.time_limit
 
-                    db.session.commit()
-                else:
+            for percent, user_list in percent_user_map.items():
+                extension_response = extend_quiz(
+                    quiz,
+                    is_new,
+                    percent,
+                    user_list,
+                    skip_unchanged=current_extra_time is not None,
+                    current_extra_time=current_extra_time,
+                )
+                record_retries(job, extension_response)
+
+                if extension_response.get("success", False) is not True:
+                    bulk_upsert(db.session, Quiz, quiz_rows, ["canvas_id"])
                     error_message = "Some quizzes couldn't be updated. "
                     error_message += extension_response.get("message", "")
                     update_job(job, comp_perc, error_message, "failed", error=True)
                     return job.meta
 
+            # add/update quiz, saved in bulk below
+            quiz_rows.append(quiz_snapshot(quiz, course.id))
+
+        bulk_upsert(db.session, Quiz, quiz_rows, ["canvas_id"])
+        course.quizzes_synced_at = synced_at
+        db.session.commit()
+        invalidate_missing_check(job.connection, course_id)
+
         msg = "{} quizzes have been updated.".format(len(quizzes))
         update_job(job, 100, msg, "complete", error=False)
         return job.meta